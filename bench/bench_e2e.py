@@ -0,0 +1,214 @@
+# bench_e2e.py
+# End-to-end benchmark: RelayController (control loop + persistence) and WebServer on
+# the simulated backend in sim.py, hammered by concurrent keep-alive HTTP clients.
+# Reports request latency percentiles, control-loop jitter, relay switch counts and
+# allocation figures. Runs under CPython.
+#
+#   python bench/bench_e2e.py [--clients N] [--duration S] [--period-ms MS] [--trace]
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+
+from relay_control import RelayController
+from sim import SimBackend
+from web_server import WebServer
+
+RELAY_PINS = [5, 4, 0, 2]
+TEMP_PIN = 14
+HEATERS = {5: 0, 4: 1}      # Relays 0 and 1 heat the zones of sensors 0 and 1
+SIM_SPEED = 60              # One real second is one simulated minute
+HOST = '127.0.0.1'
+# Request mix per client: mostly dashboard polling, some conditional polls and writes
+MIX = (
+    (0.70, b"GET /api/get_all_status HTTP/1.1\r\n\r\n"),
+    (0.15, None),           # Conditional status poll with the last ETag
+    (0.05, b"GET /api/history?sensor=0&res=raw HTTP/1.1\r\n\r\n"),
+    (0.05, b"GET /toggle?i=2 HTTP/1.1\r\n\r\n"),
+    (0.05, b"GET /set?i=3&lock=0 HTTP/1.1\r\n\r\n"),
+)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def read_response(reader):
+    """Returns (status code, headers dict, body) of one HTTP/1.1 response."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    code = int(status_line.split(b' ', 2)[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get(b'content-length', b'0')))
+    return code, headers, body
+
+
+def pick_request(rng, etag):
+    r = rng.random()
+    for weight, request in MIX:
+        r -= weight
+        if r < 0:
+            break
+    if request is None:
+        if etag is None:
+            return MIX[0][1]
+        return b"GET /api/get_all_status HTTP/1.1\r\nIf-None-Match: " + etag + b"\r\n\r\n"
+    return request
+
+
+async def client(port, deadline, seed, latencies, codes):
+    rng = random.Random(seed)
+    etag = None
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection(HOST, port)
+        request = pick_request(rng, etag)
+        t0 = time.perf_counter()
+        try:
+            writer.write(request)
+            await writer.drain()
+            code, headers, _ = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            writer = None # Server closed it (max requests per connection); reconnect
+            continue
+        latencies.append(time.perf_counter() - t0)
+        codes[code] = codes.get(code, 0) + 1
+        if b'etag' in headers:
+            etag = headers[b'etag']
+        if headers.get(b'connection', b'').lower() == b'close':
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def configure(controller):
+    for i in (0, 1):
+        controller.settings[i].update({'mode': 'AUTO', 'low': 22.0, 'high': 24.0, 'hyst': 0.25,
+                                       'sensor': controller.sensors.rom(i), 'lock': False, 'min_on': 0, 'min_off': 0})
+    controller.settings_changed()
+
+
+def instrument_loop(controller):
+    """Records when each control tick runs, by wrapping this instance's control step."""
+    ticks = []
+    control = controller.control_relays_by_temp
+
+    def timed(temps=None):
+        ticks.append(time.perf_counter())
+        return control(temps)
+
+    controller.control_relays_by_temp = timed
+    return ticks
+
+
+async def run(args):
+    hw = SimBackend(num_sensors=2, heaters=HEATERS, speed=SIM_SPEED, crc_error_rate=args.crc_error_rate, seed=1)
+    controller = RelayController(RELAY_PINS, TEMP_PIN, sensor_resolution=args.resolution, hw=hw)
+    configure(controller)
+    ticks = instrument_loop(controller)
+    switches0 = list(controller.stats.switches) # Counters persist across runs in bench/.work
+
+    server = WebServer(controller, port=args.port, max_connections=args.clients + 1)
+    tasks = [asyncio.create_task(controller.run_control_loop(args.period_ms)),
+             asyncio.create_task(controller.run_persistence()),
+             asyncio.create_task(server.serve(HOST))]
+    await asyncio.sleep(0.2) # let the server bind
+
+    latencies = []
+    codes = {}
+    gc0 = gc.get_stats()[0]['collections']
+    if args.trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    deadline = t0 + args.duration
+    await asyncio.gather(*[client(args.port, deadline, n, latencies, codes) for n in range(args.clients)])
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] if args.trace else None
+    if args.trace:
+        tracemalloc.stop()
+    gc0 = gc.get_stats()[0]['collections'] - gc0
+    await asyncio.sleep(0.1) # let the server notice the closed connections
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    controller.flush_settings()
+    return {
+        "elapsed": elapsed, "latencies": sorted(latencies), "codes": codes,
+        "ticks": [t for t in ticks if t >= t0], "switches": [n - n0 for n, n0 in zip(controller.stats.switches, switches0)],
+        "temps": hw.temperatures(), "reads": hw.reads, "crc_errors": hw.crc_errors,
+        "conversion_ms": controller.conversion_time_ms, "peak": peak, "gc0": gc0,
+        "flash_writes": controller.store.writes + controller.stats.store.writes,
+    }
+
+
+def report(args, r):
+    lat = r["latencies"]
+    ms = lambda p: percentile(lat, p) * 1000
+    print(f"clients {args.clients}, {r['elapsed']:.1f} s, {len(lat)} requests, {len(lat) / r['elapsed']:.0f} req/s")
+    print(f"latency ms: p50 {ms(50):.2f}  p90 {ms(90):.2f}  p99 {ms(99):.2f}  max {ms(100):.2f}")
+    print("status codes: " + ", ".join(f"{c}={n}" for c, n in sorted(r["codes"].items())))
+
+    # Expected interval: conversion wait plus the loop's sleep
+    expected = (r["conversion_ms"] + args.period_ms) / 1000
+    intervals = [b - a for a, b in zip(r["ticks"], r["ticks"][1:])]
+    if intervals:
+        jitter = sorted(abs(i - expected) * 1000 for i in intervals)
+        print(f"control loop: {len(r['ticks'])} ticks, expected interval {expected * 1000:.0f} ms, "
+              f"jitter p50 {percentile(jitter, 50):.1f} ms  p99 {percentile(jitter, 99):.1f} ms  max {jitter[-1]:.1f} ms")
+    print(f"relay switches: {r['switches']}  flash writes: {r['flash_writes']}")
+    print(f"sensor reads: {r['reads']}  crc errors: {r['crc_errors']}  "
+          f"zone temps: {', '.join('%.2f' % t for t in r['temps'])}")
+    alloc = f"gen-0 collections: {r['gc0']}"
+    if r["peak"] is not None:
+        alloc += f"  traced peak heap: {r['peak']} B"
+    print(alloc)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--period-ms', type=int, default=100)
+    parser.add_argument('--resolution', type=int, default=9, choices=(9, 10, 11, 12))
+    parser.add_argument('--crc-error-rate', type=float, default=0.01)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--trace', action='store_true', help="measure peak heap with tracemalloc (slower)")
+    args = parser.parse_args()
+
+    workdir = os.path.join(_HERE, '.work')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir) # keep relay_config.json and friends out of the repo root
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') # the controller's [TAG] prints would dominate the timing
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    report(args, result)
+
+
+if __name__ == '__main__':
+    main()
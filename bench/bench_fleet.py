@@ -0,0 +1,125 @@
+# bench_fleet.py
+# Sweep time versus fleet size for fleet.collector against simulated devices: each device
+# is a real RelayController + WebServer on sim.SimBackend, listening on localhost, with an
+# added per-response delay standing in for Wi-Fi and ESP8266 processing time.
+# Compares a sequential poller (one request at a time, new connection per request) with
+# the concurrent keep-alive collector, and times a /toggle fan-out. Runs under CPython.
+#
+#   python bench/bench_fleet.py [--sizes 1,4,16,64] [--latency-ms 50] [--sweeps 5]
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+
+from relay_control import RelayController
+from sim import SimBackend
+from web_server import WebServer
+from fleet.collector import Device, Fleet
+from fleet.tsstore import TimeSeriesStore
+
+HOST = '127.0.0.1'
+BASE_PORT = 19000
+CONTROL_PERIOD_MS = 500
+
+
+class SimulatedDevice(WebServer):
+    """WebServer that delays every response, like a board on a real network."""
+    def __init__(self, controller, port, latency):
+        super().__init__(controller, port=port, max_connections=4)
+        self.latency = latency
+
+    async def _send(self, writer, head, body, keep_alive):
+        await asyncio.sleep(self.latency)
+        await super()._send(writer, head, body, keep_alive)
+
+
+async def start_devices(count, latency, workdir):
+    tasks = []
+    servers = []
+    for n in range(count):
+        devdir = os.path.join(workdir, f"dev{n}")
+        os.makedirs(devdir, exist_ok=True)
+        os.chdir(devdir) # Each controller keeps its settings files apart
+        controller = RelayController([5, 4, 0, 2], 14, sensor_resolution=9, hw=SimBackend(seed=n))
+        server = SimulatedDevice(controller, BASE_PORT + n, latency)
+        servers.append(server)
+        tasks.append(asyncio.create_task(server.serve(HOST)))
+        tasks.append(asyncio.create_task(controller.run_control_loop(CONTROL_PERIOD_MS)))
+    await asyncio.sleep(0.3) # let the servers bind
+    return tasks, servers
+
+
+async def measure(size, args, workdir):
+    device_tasks, servers = await start_devices(size, args.latency_ms / 1000, workdir)
+    try:
+        sequential = Fleet([Device(HOST, BASE_PORT + n, keep_alive=False) for n in range(size)], concurrency=1)
+        seq = await sequential.sweep()
+
+        store = TimeSeriesStore(os.path.join(workdir, f"store{size}"))
+        fleet = Fleet([Device(HOST, BASE_PORT + n) for n in range(size)], store)
+        cold = await fleet.sweep() # Connects and fetches full documents
+        warm = []
+        for _ in range(args.sweeps):
+            await asyncio.sleep(args.interval)
+            warm.append(await fleet.sweep())
+        start = asyncio.get_running_loop().time()
+        errors = await fleet.toggle_all(3)
+        fan_out_s = asyncio.get_running_loop().time() - start
+        rows = len(store)
+        connects = sum(d.connects for d in fleet.devices)
+        failed = seq.failed + cold.failed + sum(r.failed for r in warm) + sum(1 for e in errors.values() if e)
+        fleet.close()
+        store.close()
+    finally:
+        for server in servers:
+            if server._server is not None:
+                server._server.close() # Frees the port for the next size
+        for t in device_tasks:
+            t.cancel()
+        await asyncio.gather(*device_tasks, return_exceptions=True)
+    return {
+        "seq_ms": seq.elapsed * 1000, "cold_ms": cold.elapsed * 1000,
+        "warm_ms": statistics.median(r.elapsed for r in warm) * 1000,
+        "not_modified": sum(r.not_modified for r in warm), "polls": size * len(warm),
+        "fan_out_ms": fan_out_s * 1000, "rows": rows, "connects": connects, "failed": failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default="1,4,16,64")
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--sweeps', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between timed sweeps")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    results = []
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        sys.stdout = open(os.devnull, 'w') # the controllers' [TAG] prints would dominate the timing
+        try:
+            for size in sizes:
+                results.append((size, asyncio.run(measure(size, args, workdir))))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            os.chdir(cwd)
+
+    print(f"device latency {args.latency_ms:.0f} ms, {args.sweeps} timed sweeps per size")
+    print(f"{'devices':>7} {'sequential ms':>14} {'cold ms':>9} {'warm ms':>9} {'304 %':>6} "
+          f"{'toggle fan-out ms':>18} {'connects':>9} {'rows':>6} {'failed':>7}")
+    for size, r in results:
+        print(f"{size:>7} {r['seq_ms']:>14.1f} {r['cold_ms']:>9.1f} {r['warm_ms']:>9.1f} "
+              f"{100 * r['not_modified'] / r['polls']:>6.0f} {r['fan_out_ms']:>18.1f} "
+              f"{r['connects']:>9} {r['rows']:>6} {r['failed']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# bench_routes.py
+# Micro-benchmark of request parsing + routing + handler per route: requests/sec and
+# heap churn per request. Runs under CPython against the simulated backend in sim.py.
+#
+#   python bench/bench_routes.py [iterations]
+import os
+import sys
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+
+from relay_control import RelayController
+from sim import SimBackend
+from web_server import parse_request_line, handle_request
+
+REQUESTS = (
+    ("status", b"GET /api/get_all_status HTTP/1.1\r\n"),
+    ("root", b"GET / HTTP/1.1\r\n"),
+    ("toggle", b"GET /toggle?i=1 HTTP/1.1\r\n"),
+    ("set", b"GET /set?i=0&on=21.5&off=25.0&mode=AUTO&sensor=0&hyst=0.5 HTTP/1.1\r\n"),
+    ("stats", b"GET /api/relays/stats HTTP/1.1\r\n"),
+    ("history", b"GET /api/history?sensor=0&res=raw HTTP/1.1\r\n"),
+    ("metrics", b"GET /metrics HTTP/1.1\r\n"),
+    ("not_found", b"GET /nope HTTP/1.1\r\n"),
+)
+CHURN_ITERATIONS = 50
+
+
+def _one(controller, line):
+    method, path, query, _ = parse_request_line(line)
+    _, body = handle_request(controller, method, path, query)
+    if not isinstance(body, (bytes, bytearray)):
+        for _ in body:
+            pass
+
+
+def bench_route(controller, line, iterations):
+    """Returns (requests per second, peak transient heap bytes per request)."""
+    _one(controller, line) # warm caches (status JSON etc.)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        _one(controller, line)
+    elapsed = time.perf_counter() - t0
+
+    # CPython frees eagerly, so the traced peak is the transient heap a request needs
+    tracemalloc.start()
+    for _ in range(CHURN_ITERATIONS):
+        _one(controller, line)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return iterations / elapsed, peak
+
+
+def run(iterations=2000):
+    controller = RelayController([5, 4, 0, 2], 14, hw=SimBackend(seed=1))
+    controller.history.add({0: 22.0, 1: 23.0})
+    return [(name,) + bench_route(controller, line, iterations) for name, line in REQUESTS]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workdir = os.path.join(_HERE, '.work')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir) # keep relay_config.json and friends out of the repo root
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') # the controller's [TAG] prints would dominate the timing
+    try:
+        results = run(iterations)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{'route':<10} {'req/s':>10} {'us/req':>8} {'peak heap B':>12}")
+    for name, rps, peak in results:
+        print(f"{name:<10} {rps:>10.0f} {1e6 / rps:>8.1f} {peak:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# clock.py
+# Wall-clock time for schedules: set by NTP when the network allows it, and carried
+# forward between syncs by the monotonic uptime counter (the ESP8266 RTC drifts badly).
+import sys
+import time
+import struct
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from compat import uptime_ms, ticks_ms, ticks_diff, ticks_add
+import log
+
+DEFAULT_NTP_HOST = "pool.ntp.org"
+RESYNC_INTERVAL_S = 6 * 3600
+RETRY_INTERVAL_S = 60
+NTP_TIMEOUT_MS = 2000
+NTP_POLL_MS = 50
+# Seconds from the NTP epoch (1900) to the port's epoch (2000 on most MicroPython ports, 1970 elsewhere)
+NTP_DELTA = 3155673600 if time.gmtime(0)[0] == 2000 else 2208988800
+
+
+class Clock:
+    def __init__(self, tz_offset_min=0, ntp_host=DEFAULT_NTP_HOST):
+        """
+        :param tz_offset_min: Local time minus UTC, in minutes (no DST handling).
+        :param ntp_host: NTP server, None to rely on /api/time. Resolving a name blocks the
+                         event loop once (an IP address does not); the exchange itself does not.
+        """
+        self.tz_offset_s = tz_offset_min * 60
+        self.ntp_host = ntp_host
+        self._ntp_addr = None     # Resolved once, on the first attempt that gets that far
+        self._base_epoch = None   # UTC seconds at _base_uptime_ms
+        self._base_uptime_ms = 0
+        self.last_sync_s = None   # Local time of the last successful sync
+        self.source = None        # 'ntp', 'host' or 'api'
+        self.on_change = None     # on_change(previous local time or None), called after every set
+
+    @property
+    def synced(self):
+        return self._base_epoch is not None
+
+    def set(self, utc_epoch, source='api'):
+        """Sets the current UTC time (seconds, 1970 or 2000 epoch)."""
+        previous = self.now()
+        self._base_epoch = int(utc_epoch)
+        self._base_uptime_ms = uptime_ms()
+        self.source = source
+        self.last_sync_s = self.now()
+        if self.on_change is not None:
+            self.on_change(previous)
+
+    async def _query_ntp(self):
+        """One SNTP exchange on a non-blocking socket. Returns UTC seconds in the port's epoch."""
+        if self._ntp_addr is None:
+            self._ntp_addr = socket.getaddrinfo(self.ntp_host, 123)[0][-1]
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.setblocking(False)
+            query = bytearray(48)
+            query[0] = 0x1B # LI 0, version 3, mode 3 (client)
+            s.sendto(query, self._ntp_addr)
+            deadline = ticks_add(ticks_ms(), NTP_TIMEOUT_MS)
+            while True:
+                try:
+                    msg = s.recv(48)
+                    break
+                except OSError: # EAGAIN: no reply yet
+                    if ticks_diff(deadline, ticks_ms()) <= 0:
+                        raise OSError("no reply from NTP server")
+                    await asyncio.sleep(NTP_POLL_MS / 1000)
+        finally:
+            s.close()
+        return struct.unpack("!I", msg[40:44])[0] - NTP_DELTA # Transmit timestamp, whole seconds
+
+    async def sync(self):
+        """One NTP attempt; on CPython the host clock is taken as already synced. Returns success."""
+        if sys.implementation.name != 'micropython':
+            self.set(time.time(), 'host')
+            return True
+        if not self.ntp_host:
+            return False
+        try:
+            utc = await self._query_ntp()
+        except Exception as e:
+            if log.level <= log.DEBUG: print(f"[CLOCK] NTP sync failed: {e}")
+            return False
+        self.set(utc, 'ntp')
+        return True
+
+    def now(self):
+        """Local time in whole seconds, or None until the clock has been set once."""
+        if self._base_epoch is None:
+            return None
+        return self._base_epoch + (uptime_ms() - self._base_uptime_ms) // 1000 + self.tz_offset_s
+
+    def time_of_day(self):
+        """
+        Local seconds since midnight, or None if the time is unknown. MicroPython counts
+        from 2000-01-01 and CPython from 1970-01-01, both midnight UTC, so this is the
+        same for either epoch.
+        """
+        now = self.now()
+        return None if now is None else now % 86400
+
+    async def run(self):
+        """Background task: syncs at start, retries until it succeeds, then resyncs periodically."""
+        while True:
+            ok = await self.sync()
+            if ok and log.level <= log.INFO: print(f"[CLOCK] Synced ({self.source}), local time {format_tod(self.time_of_day())}")
+            await asyncio.sleep(RESYNC_INTERVAL_S if ok else RETRY_INTERVAL_S)
+
+
+def format_tod(seconds):
+    if seconds is None:
+        return None
+    return "%02d:%02d" % (seconds // 3600, seconds // 60 % 60)
+
+
+def parse_tod(text):
+    """'HH:MM' -> seconds since midnight; raises ValueError."""
+    hh, sep, mm = str(text).partition(':')
+    if not sep or not hh.isdigit() or not mm.isdigit():
+        raise ValueError(f"expected HH:MM, got '{text}'")
+    h, m = int(hh), int(mm)
+    if h > 23 or m > 59:
+        raise ValueError(f"time out of range: '{text}'")
+    return h * 3600 + m * 60
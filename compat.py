@@ -0,0 +1,43 @@
+# compat.py
+# Small shims so the same modules run on MicroPython and on CPython (off-device tests/benchmarks).
+import sys
+import time
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_diff = time.ticks_diff
+    ticks_add = time.ticks_add
+except AttributeError:
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def ticks_add(a, delta):
+        return a + delta
+
+
+def print_exception(e):
+    if hasattr(sys, 'print_exception'):
+        sys.print_exception(e) # MicroPython
+    else:
+        import traceback
+        traceback.print_exception(e)
+
+
+_uptime_ms = 0
+_last_ticks = ticks_ms()
+
+
+def uptime_ms():
+    """
+    Milliseconds since boot that keep increasing across the ticks_ms wrap-around.
+    Must be called at least once per ticks period (~12 days on MicroPython); the
+    control loop does so on every tick.
+    """
+    global _uptime_ms, _last_ticks
+    now = ticks_ms()
+    _uptime_ms += ticks_diff(now, _last_ticks)
+    _last_ticks = now
+    return _uptime_ms
@@ -0,0 +1,105 @@
+# control.py
+# Per-relay control strategies selected by the relay's 'mode'. Each strategy keeps its
+# state in fixed attributes set up once, and step() does a constant amount of work per
+# control tick without allocating.
+from compat import ticks_diff
+
+
+class Hysteresis:
+    """Heating on/off control: ON at or below low - hyst, OFF at or above high + hyst."""
+    mode = 'AUTO'
+
+    def reset(self):
+        pass
+
+    def step(self, temp, setting, is_on, now_ms):
+        """
+        :param temp: Current reading of the relay's sensor.
+        :param setting: The relay's settings dict.
+        :param is_on: Current relay state.
+        :param now_ms: ticks_ms() of this tick.
+        :return: True/False for the wanted relay state, None to leave it as it is.
+        """
+        if temp <= setting['low'] - setting['hyst']:
+            return True
+        if temp >= setting['high'] + setting['hyst']:
+            return False
+        return None
+
+
+class Cooling(Hysteresis):
+    """Inverted hysteresis for fans and coolers: ON at or above high + hyst, OFF at or below low - hyst."""
+    mode = 'COOLING'
+
+    def step(self, temp, setting, is_on, now_ms):
+        if temp >= setting['high'] + setting['hyst']:
+            return True
+        if temp <= setting['low'] - setting['hyst']:
+            return False
+        return None
+
+
+class PID:
+    """
+    Heating PID whose output (0..1) is applied as a duty cycle over a time-proportioning
+    window of setting['window'] seconds: the relay is ON for the first output * window
+    of each window. The duty resolution is one control period.
+    Anti-windup: the integral term is clamped to the output range and stops accumulating
+    while the output is saturated in the direction of the error.
+    The derivative acts on the measurement, so setpoint changes do not kick the output.
+    """
+    mode = 'PID'
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0      # Integral term, already scaled by ki
+        self.last_temp = None
+        self.last_ms = 0
+        self.window_start_ms = None
+        self.output = 0.0
+
+    def step(self, temp, setting, is_on, now_ms):
+        error = setting['setpoint'] - temp
+        if self.last_temp is None:
+            dt = 0.0
+            derivative = 0.0
+            self.window_start_ms = now_ms
+        else:
+            dt = ticks_diff(now_ms, self.last_ms) / 1000
+            derivative = (temp - self.last_temp) / dt if dt > 0 else 0.0
+        self.last_temp = temp
+        self.last_ms = now_ms
+
+        p = setting['kp'] * error
+        d = -setting['kd'] * derivative
+        integral = self.integral + setting['ki'] * error * dt
+        integral = 0.0 if integral < 0.0 else 1.0 if integral > 1.0 else integral
+        out = p + integral + d
+        # Conditional integration: keep the old integral if the new one only pushes a saturated output further
+        if (out > 1.0 and integral > self.integral) or (out < 0.0 and integral < self.integral):
+            out += self.integral - integral
+        else:
+            self.integral = integral
+        self.output = 0.0 if out < 0.0 else 1.0 if out > 1.0 else out
+
+        window_ms = setting['window'] * 1000
+        elapsed = ticks_diff(now_ms, self.window_start_ms)
+        if elapsed >= window_ms:
+            self.window_start_ms = now_ms
+            elapsed = 0
+        return elapsed < self.output * window_ms
+
+
+STRATEGIES = {
+    Hysteresis.mode: Hysteresis,
+    Cooling.mode: Cooling,
+    PID.mode: PID,
+}
+
+
+def make_strategy(mode):
+    """Strategy object for a relay mode, None for MANUAL."""
+    cls = STRATEGIES.get(mode)
+    return cls() if cls is not None else None
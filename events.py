@@ -0,0 +1,77 @@
+# events.py
+# Fan-out of controller changes to streaming (Server-Sent Events) subscribers.
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+import log
+
+DEFAULT_MAX_SUBSCRIBERS = 3
+DEFAULT_QUEUE_SIZE = 8 # Pending events per subscriber before it is dropped as too slow
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = []
+        self.queue_size = queue_size
+        self.event = asyncio.Event()
+        self.closed = False
+
+    def push(self, item):
+        if len(self.queue) >= self.queue_size:
+            return False
+        self.queue.append(item)
+        self.event.set()
+        return True
+
+    async def get(self, timeout):
+        """Returns the next pending item, or None on timeout or when the subscription was closed."""
+        if not self.queue and not self.closed:
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.closed or not self.queue:
+            return None
+        return self.queue.pop(0)
+
+
+class EventHub:
+    def __init__(self, max_subscribers=DEFAULT_MAX_SUBSCRIBERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.subscribers = []
+        self.dropped = 0 # Subscribers disconnected for falling behind
+
+    def subscribe(self):
+        if len(self.subscribers) >= self.max_subscribers:
+            return None
+        sub = Subscription(self.queue_size)
+        self.subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        sub.event.set()
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
+
+    def publish(self, delta):
+        """
+        Queues a delta for every subscriber without ever awaiting, so it is safe to call
+        from the control loop. A subscriber whose queue is full is dropped.
+        """
+        if not self.subscribers:
+            return
+        # Serialized once and shared by all subscribers
+        data = b"data: " + ujson.dumps(delta).encode('utf-8') + b"\n\n"
+        for sub in self.subscribers[:]:
+            if not sub.push(data):
+                if log.level <= log.INFO: print("[EVENTS] Dropping slow subscriber.")
+                self.dropped += 1
+                self.unsubscribe(sub)
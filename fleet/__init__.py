@@ -0,0 +1,2 @@
+# Fleet collector: a CPython companion for polling and commanding many controllers.
+# Not meant to be copied to the boards.
@@ -0,0 +1,281 @@
+# collector.py
+# Fleet collector (CPython): polls many relay controllers concurrently over persistent
+# HTTP/1.1 connections, records their status into a TimeSeriesStore and fans commands
+# (/set, /toggle) out to the whole fleet.
+#
+#   python -m fleet.collector host[:port] ... [--interval S] [--store DIR]
+#   python -m fleet.collector host ... --toggle 1
+#   python -m fleet.collector host ... --set "i=0&mode=AUTO&on=21&off=23"
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fleet.tsstore import TimeSeriesStore
+
+DEFAULT_PORT = 12345
+DEFAULT_TIMEOUT = 3.0        # Seconds per request, connect included
+DEFAULT_CONCURRENCY = 64     # Requests in flight across the fleet
+BACKOFF_BASE = 2.0           # Seconds before retrying a device after its first failure
+BACKOFF_MAX = 300.0
+STATUS_PATH = "/api/get_all_status"
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Device:
+    """One controller: a reusable keep-alive connection plus poll and backoff state."""
+    def __init__(self, host, port=DEFAULT_PORT, name=None, timeout=DEFAULT_TIMEOUT, keep_alive=True):
+        self.host = host
+        self.port = port
+        self.name = name or f"{host}:{port}"
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock() # One request at a time per connection
+
+        self.etag = None
+        self.status = None           # Last status document
+        self.failures = 0            # Consecutive failures, drives the backoff
+        self.retry_at = 0.0          # time.monotonic() before which the device is skipped
+        self.last_error = None
+        self.last_latency = None
+        self.requests = 0
+        self.connects = 0
+
+    def __repr__(self):
+        return f"Device({self.name})"
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _exchange(self, request):
+        w = self._writer
+        w.write(request)
+        await w.drain()
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by device")
+        parts = status_line.split(b' ', 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HTTPError(f"bad status line {status_line!r}")
+        code = int(parts[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get(b'content-length')
+        if code == 304 or code == 204 or code < 200:
+            body = b"" # Never has a body, whatever the headers say
+        elif length is not None:
+            body = await self._reader.readexactly(int(length))
+        else:
+            body = await self._reader.read() # Close-delimited (streamed) body
+            headers[b'connection'] = b'close'
+        return code, headers, body
+
+    async def request(self, path, extra_headers=b""):
+        """
+        Sends a GET and returns (code, headers, body). A kept-alive connection the device
+        has meanwhile closed is retried once on a fresh connection.
+        """
+        request = (f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n".encode('utf-8') + extra_headers +
+                   (b"\r\n" if self.keep_alive else b"Connection: close\r\n\r\n"))
+        async with self._lock:
+            for attempt in (0, 1):
+                reused = self._writer is not None
+                try:
+                    start = time.perf_counter()
+                    if not reused:
+                        await asyncio.wait_for(self._connect(), self.timeout)
+                    code, headers, body = await asyncio.wait_for(self._exchange(request), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                    self.close()
+                    if reused and attempt == 0 and not isinstance(e, asyncio.TimeoutError):
+                        continue # Stale keep-alive connection
+                    raise
+                except BaseException:
+                    self.close() # Timeout or cancellation mid-response: the stream is unusable
+                    raise
+                self.requests += 1
+                self.last_latency = time.perf_counter() - start
+                if not self.keep_alive or headers.get(b'connection', b'').lower() == b'close':
+                    self.close()
+                return code, headers, body
+
+    def record_failure(self, error, now):
+        self.failures += 1
+        self.last_error = repr(error)
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+        self.retry_at = now + delay * random.uniform(0.8, 1.2) # Jitter keeps retries from lining up
+
+    def record_success(self):
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error = None
+
+
+def normalize(status):
+    """Yields (channel, value) pairs from a /api/get_all_status document."""
+    names = status.get('sensors') or []
+    for slot, temp in status.get('temperatures', {}).items():
+        i = int(slot)
+        name = names[i] if i < len(names) else slot
+        yield f"temp/{name}", float(temp)
+    for i, relay in enumerate(status.get('relays', [])):
+        yield f"relay/{i}", 1.0 if relay.get('state') else 0.0
+        if 'output' in relay:
+            yield f"output/{i}", float(relay['output'])
+
+
+class SweepResult:
+    def __init__(self):
+        self.updated = 0        # 200 with a new status
+        self.not_modified = 0   # 304, nothing to parse or store
+        self.failed = 0
+        self.skipped = 0        # In backoff
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (f"SweepResult(updated={self.updated}, not_modified={self.not_modified}, "
+                f"failed={self.failed}, skipped={self.skipped}, elapsed={self.elapsed * 1000:.1f} ms)")
+
+
+class Fleet:
+    def __init__(self, devices, store=None, concurrency=DEFAULT_CONCURRENCY):
+        """
+        :param devices: Device objects.
+        :param store: Optional TimeSeriesStore receiving every changed status.
+        :param concurrency: Upper bound on requests in flight across the fleet.
+        """
+        self.devices = list(devices)
+        self.store = store
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _poll(self, device, result):
+        now = time.monotonic()
+        if device.retry_at > now:
+            result.skipped += 1
+            return
+        # The device serves a cached document per version; an unchanged one is a bodyless 304
+        extra = b"If-None-Match: " + device.etag + b"\r\n" if device.etag else b""
+        try:
+            async with self._slots:
+                code, headers, body = await device.request(STATUS_PATH, extra)
+            if code == 304:
+                result.not_modified += 1
+            elif code == 200:
+                device.status = json.loads(body)
+                device.etag = headers.get(b'etag')
+                if self.store is not None:
+                    t = time.time()
+                    for channel, value in normalize(device.status):
+                        self.store.append(t, device.name, channel, value)
+                result.updated += 1
+            else:
+                raise HTTPError(f"HTTP {code}")
+        except Exception as e:
+            device.record_failure(e, time.monotonic())
+            result.failed += 1
+            return
+        device.record_success()
+
+    async def sweep(self):
+        """Polls every device once, concurrently. Returns a SweepResult."""
+        result = SweepResult()
+        start = time.perf_counter()
+        await asyncio.gather(*[self._poll(d, result) for d in self.devices])
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    async def run(self, interval, sweeps=None):
+        """Sweeps every `interval` seconds (forever, or `sweeps` times), flushing the store each time."""
+        n = 0
+        while sweeps is None or n < sweeps:
+            start = time.monotonic()
+            result = await self.sweep()
+            if self.store is not None:
+                self.store.flush()
+            print(f"[FLEET] {result}")
+            n += 1
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+    async def _command(self, device, path):
+        try:
+            async with self._slots:
+                code, _, body = await device.request(path)
+        except Exception as e:
+            return repr(e)
+        # /set and /toggle answer with a redirect to the dashboard on success
+        if code in (200, 302):
+            device.etag = None # Next poll fetches the new state
+            return None
+        return f"HTTP {code}: {body[:80]!r}"
+
+    async def fan_out(self, path):
+        """Sends one GET command to every device concurrently. Returns {device name: error or None}."""
+        errors = await asyncio.gather(*[self._command(d, path) for d in self.devices])
+        return {d.name: e for d, e in zip(self.devices, errors)}
+
+    async def toggle_all(self, relay):
+        return await self.fan_out(f"/toggle?i={int(relay)}")
+
+    async def set_all(self, relay, **params):
+        """e.g. set_all(0, mode='AUTO', on=21.0, off=23.0); parameters as accepted by /set."""
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return await self.fan_out(f"/set?i={int(relay)}" + (f"&{query}" if query else ""))
+
+    def close(self):
+        for d in self.devices:
+            d.close()
+
+
+def parse_device(spec, timeout=DEFAULT_TIMEOUT):
+    host, _, port = spec.rpartition(':') if ':' in spec else (spec, '', '')
+    return Device(host, int(port) if port else DEFAULT_PORT, timeout=timeout)
+
+
+async def _main(args):
+    store = TimeSeriesStore(args.store) if args.store else None
+    fleet = Fleet([parse_device(s, args.timeout) for s in args.devices], store, args.concurrency)
+    try:
+        if args.toggle is not None or args.set is not None:
+            path = f"/toggle?i={args.toggle}" if args.toggle is not None else f"/set?{args.set}"
+            for name, error in (await fleet.fan_out(path)).items():
+                print(f"{name}: {error or 'ok'}")
+            return
+        await fleet.run(args.interval, args.sweeps)
+    finally:
+        fleet.close()
+        if store is not None:
+            store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll a fleet of relay controllers.")
+    parser.add_argument('devices', nargs='+', help="host or host:port")
+    parser.add_argument('--interval', type=float, default=10.0, help="seconds between sweeps")
+    parser.add_argument('--sweeps', type=int, default=None, help="stop after this many sweeps")
+    parser.add_argument('--store', default=None, help="directory of the time-series store")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--toggle', type=int, default=None, help="toggle this relay on every device and exit")
+    parser.add_argument('--set', default=None, help="send /set?<query> to every device and exit")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# tsstore.py
+# Append-only columnar time-series store for the fleet collector (CPython only).
+# Each column is its own flat binary file of fixed-size values, so appends are plain
+# writes and reads are zero-copy memory maps (NumPy arrays when NumPy is installed).
+import array
+import json
+import mmap
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# (column, array typecode); files hold native byte order
+COLUMNS = (('time', 'd'), ('device', 'H'), ('channel', 'H'), ('value', 'f'))
+META_FILE = "meta.json"
+FLUSH_ROWS = 4096 # Pending rows written out automatically
+
+
+class TimeSeriesStore:
+    """
+    Rows are (time, device id, channel id, value); device and channel names are mapped
+    to ids in meta.json. Rows are appended in arrival order, so time is non-decreasing
+    per device but not across devices.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.devices = []
+        self.channels = []
+        self._device_ids = {}
+        self._channel_ids = {}
+        self._load_meta()
+
+        self._pending = {name: array.array(code) for name, code in COLUMNS}
+        self._files = {}
+        self._maps = []
+        self._views = None
+        self._view_rows = -1
+        # A crash between column writes leaves ragged files; cut them back to the shortest
+        rows = min(self._file_rows(name, code) for name, code in COLUMNS)
+        for name, code in COLUMNS:
+            f = open(self._column_path(name), 'ab')
+            f.truncate(rows * array.array(code).itemsize)
+            self._files[name] = f
+        self.persisted_rows = rows
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    def _file_rows(self, name, code):
+        try:
+            return os.path.getsize(self._column_path(name)) // array.array(code).itemsize
+        except OSError:
+            return 0
+
+    def _load_meta(self):
+        try:
+            with open(os.path.join(self.path, META_FILE)) as f:
+                meta = json.load(f)
+        except OSError:
+            return
+        for name in meta.get('devices', []):
+            self.device_id(name)
+        for name in meta.get('channels', []):
+            self.channel_id(name)
+
+    def _save_meta(self):
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump({"devices": self.devices, "channels": self.channels}, f)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    def device_id(self, name):
+        i = self._device_ids.get(name)
+        if i is None:
+            i = self._device_ids[name] = len(self.devices)
+            self.devices.append(name)
+        return i
+
+    def channel_id(self, name):
+        i = self._channel_ids.get(name)
+        if i is None:
+            i = self._channel_ids[name] = len(self.channels)
+            self.channels.append(name)
+        return i
+
+    def __len__(self):
+        return self.persisted_rows + len(self._pending['time'])
+
+    def append(self, t, device, channel, value):
+        """:param device, channel: Names; ids are assigned on first use."""
+        p = self._pending
+        p['time'].append(t)
+        p['device'].append(self.device_id(device))
+        p['channel'].append(self.channel_id(channel))
+        p['value'].append(value)
+        if len(p['time']) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        rows = len(self._pending['time'])
+        if not rows:
+            return
+        self._save_meta() # Before the rows, so every stored id has a name
+        for name, code in COLUMNS:
+            f = self._files[name]
+            f.write(self._pending[name].tobytes())
+            f.flush()
+            self._pending[name] = array.array(code)
+        self.persisted_rows += rows
+
+    def columns(self):
+        """
+        Memory-mapped views of all stored rows: {column: NumPy array or memoryview}.
+        Flushes first. The views stay valid until close().
+        """
+        self.flush()
+        if self._view_rows == self.persisted_rows:
+            return self._views
+        self._views = None
+        self._release_maps()
+        out = {}
+        for name, code in COLUMNS:
+            if not self.persisted_rows:
+                out[name] = numpy.empty(0, code) if numpy is not None else memoryview(array.array(code))
+                continue
+            with open(self._column_path(name), 'rb') as f:
+                m = mmap.mmap(f.fileno(), self.persisted_rows * array.array(code).itemsize, access=mmap.ACCESS_READ)
+            self._maps.append(m)
+            out[name] = numpy.frombuffer(m, dtype=code) if numpy is not None else memoryview(m).cast(code)
+        self._views = out
+        self._view_rows = self.persisted_rows
+        return out
+
+    def _release_maps(self):
+        kept = []
+        for m in self._maps:
+            try:
+                m.close()
+            except BufferError:
+                kept.append(m) # Still referenced by a view a caller holds
+        self._maps = kept
+
+    def query(self, device, channel, since=None):
+        """Returns (times, values) lists for one device/channel, optionally from `since` on."""
+        d = self._device_ids.get(device)
+        c = self._channel_ids.get(channel)
+        if d is None or c is None:
+            return [], []
+        cols = self.columns()
+        if numpy is not None:
+            mask = (cols['device'] == d) & (cols['channel'] == c)
+            if since is not None:
+                mask &= cols['time'] >= since
+            return cols['time'][mask].tolist(), cols['value'][mask].tolist()
+        times, values = [], []
+        t_col, d_col, c_col, v_col = cols['time'], cols['device'], cols['channel'], cols['value']
+        for i in range(len(t_col)):
+            if d_col[i] == d and c_col[i] == c and (since is None or t_col[i] >= since):
+                times.append(t_col[i])
+                values.append(v_col[i])
+        return times, values
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._views = None
+        self._view_rows = -1
+        self._release_maps()
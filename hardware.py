@@ -0,0 +1,23 @@
+# hardware.py
+# Hardware backends for RelayController. MachineBackend drives the real relay pins and
+# DS18B20 bus through MicroPython's drivers; sim.SimBackend stands in for it off-device.
+
+
+class MachineBackend:
+    def __init__(self):
+        # Imported here so the rest of the project can be loaded without MicroPython
+        import machine
+        import onewire
+        import ds18x20
+        self._machine = machine
+        self._onewire = onewire
+        self._ds18x20 = ds18x20
+        self.OneWireError = onewire.OneWireError
+
+    def relay_pin(self, pin_id):
+        """Output pin for an active-low relay, created in the OFF state."""
+        return self._machine.Pin(pin_id, self._machine.Pin.OUT, value=1)
+
+    def sensor_bus(self, pin_id):
+        """DS18X20 driver on a 1-Wire bus: scan(), convert_temp(), read_temp(rom), read/write_scratch()."""
+        return self._ds18x20.DS18X20(self._onewire.OneWire(self._machine.Pin(pin_id)))
@@ -0,0 +1,180 @@
+# history.py
+# Fixed-size temperature history per sensor with 1-min and 15-min min/avg/max rollups.
+# All storage is preallocated arrays, so recording a sample does not allocate.
+import struct
+from array import array
+from compat import uptime_ms
+
+RAW_CAPACITY = 120        # One sample per control tick (10 min at the default 5 s period)
+# (name, bucket seconds, capacity): 2 h of 1-min and 24 h of 15-min buckets
+ROLLUPS = (('1m', 60, 120), ('15m', 900, 96))
+RESOLUTIONS = ('raw',) + tuple(r[0] for r in ROLLUPS)
+
+RAW_RECORD = '<Ih'        # t (s since boot), centi-degrees
+ROLLUP_RECORD = '<Ihhh'   # t (bucket start), min, avg, max in centi-degrees
+CHUNK_ROWS = 16
+
+
+def _centi(t):
+    v = int(round(t * 100))
+    return -32768 if v < -32768 else 32767 if v > 32767 else v
+
+
+class Ring:
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = columns
+        self.times = array('I', bytearray(4 * capacity))
+        self.values = array('h', bytearray(2 * capacity * columns))
+        self.head = 0 # Next slot to write
+        self.count = 0
+
+    def append(self, t, v0, v1=0, v2=0):
+        i = self.head
+        self.times[i] = t
+        base = i * self.columns
+        self.values[base] = v0
+        if self.columns > 1:
+            self.values[base + 1] = v1
+            self.values[base + 2] = v2
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def range_since(self, since):
+        """(first slot, count) of the records whose timestamp is >= since; timestamps only grow."""
+        start = (self.head - self.count) % self.capacity
+        n = self.count
+        while n and self.times[start] < since:
+            start = (start + 1) % self.capacity
+            n -= 1
+        return start, n
+
+    def slots(self, start, n):
+        """Yields n slot indices from start, oldest first."""
+        for k in range(n):
+            yield (start + k) % self.capacity
+
+    def slots_since(self, since):
+        start, n = self.range_since(since)
+        return self.slots(start, n)
+
+
+class Rollup:
+    def __init__(self, name, period, capacity):
+        self.name = name
+        self.period = period
+        self.ring = Ring(capacity, 3)
+        self.bucket = -1
+        self.vmin = 0
+        self.vmax = 0
+        self.vsum = 0
+        self.n = 0
+
+    def add(self, t, v):
+        bucket = t // self.period
+        if bucket != self.bucket:
+            if self.n:
+                self.ring.append(self.bucket * self.period, self.vmin, self.vsum // self.n, self.vmax)
+            self.bucket = bucket
+            self.vmin = self.vmax = self.vsum = v
+            self.n = 1
+            return
+        if v < self.vmin: self.vmin = v
+        if v > self.vmax: self.vmax = v
+        self.vsum += v
+        self.n += 1
+
+
+class SensorHistory:
+    def __init__(self):
+        self.raw = Ring(RAW_CAPACITY, 1)
+        self.rollups = [Rollup(name, period, capacity) for name, period, capacity in ROLLUPS]
+
+    def clear(self):
+        """Empties the buffers in place, for a slot handed to another sensor."""
+        self.raw.clear()
+        for r in self.rollups:
+            r.ring.clear()
+            r.bucket = -1
+            r.n = 0
+
+    def add(self, t, v):
+        self.raw.append(t, v)
+        for r in self.rollups:
+            r.add(t, v)
+
+    def ring(self, res):
+        if res == 'raw':
+            return self.raw
+        for r in self.rollups:
+            if r.name == res:
+                return r.ring
+        return None
+
+
+class TemperatureHistory:
+    """Timestamps are whole seconds since boot, see compat.uptime_ms()."""
+    def __init__(self, num_sensors):
+        self.sensors = [SensorHistory() for _ in range(num_sensors)]
+
+    def add_sensor(self):
+        """Adds a buffer for a newly discovered sensor (its slot is the next index)."""
+        self.sensors.append(SensorHistory())
+
+    def uptime(self):
+        return uptime_ms() // 1000
+
+    def add(self, temps):
+        """Records one reading per sensor from a {sensor slot: temp} dict."""
+        t = self.uptime()
+        for si, temp in temps.items():
+            if 0 <= si < len(self.sensors):
+                self.sensors[si].add(t, _centi(temp))
+
+    def get_ring(self, sensor, res):
+        if not (0 <= sensor < len(self.sensors)):
+            return None
+        return self.sensors[sensor].ring(res)
+
+    def iter_csv(self, ring, since):
+        """Yields the CSV export in chunks of CHUNK_ROWS rows."""
+        yield b"t,value\n" if ring.columns == 1 else b"t,min,avg,max\n"
+        rows = []
+        for i in ring.slots_since(since):
+            base = i * ring.columns
+            if ring.columns == 1:
+                rows.append("%d,%.2f\n" % (ring.times[i], ring.values[base] / 100))
+            else:
+                rows.append("%d,%.2f,%.2f,%.2f\n" % (ring.times[i], ring.values[base] / 100,
+                                                      ring.values[base + 1] / 100, ring.values[base + 2] / 100))
+            if len(rows) == CHUNK_ROWS:
+                yield "".join(rows).encode('utf-8')
+                rows = []
+        if rows:
+            yield "".join(rows).encode('utf-8')
+
+    def pack_binary(self, ring, since):
+        """
+        Returns the records since `since` packed little-endian (RAW_RECORD or ROLLUP_RECORD).
+        Packed in one go, at most about 1 KB, so the body is a snapshot: a control tick during
+        a slow send can neither change its length nor overwrite records in it.
+        """
+        fmt = RAW_RECORD if ring.columns == 1 else ROLLUP_RECORD
+        size = struct.calcsize(fmt)
+        start, n = ring.range_since(since)
+        buf = bytearray(size * n)
+        off = 0
+        for i in ring.slots(start, n):
+            base = i * ring.columns
+            if ring.columns == 1:
+                struct.pack_into(fmt, buf, off, ring.times[i], ring.values[base])
+            else:
+                struct.pack_into(fmt, buf, off, ring.times[i], ring.values[base],
+                                 ring.values[base + 1], ring.values[base + 2])
+            off += size
+        return buf
@@ -0,0 +1,30 @@
+# log.py
+# Runtime log level for the [TAG] prints. Verbose call sites are guarded as
+#     if log.level <= log.DEBUG: print(f"...")
+# so that when the level is higher the message is never even formatted.
+ERROR = 40
+WARNING = 30
+INFO = 20
+DEBUG = 10
+LEVELS = {'ERROR': ERROR, 'WARNING': WARNING, 'INFO': INFO, 'DEBUG': DEBUG}
+
+level = INFO
+
+
+def set_level(name_or_value):
+    """Sets the level from a name ('debug', 'INFO', ...) or a number; raises ValueError if unknown."""
+    global level
+    if isinstance(name_or_value, int):
+        level = name_or_value
+        return
+    value = LEVELS.get(str(name_or_value).upper())
+    if value is None:
+        raise ValueError(f"unknown log level '{name_or_value}'")
+    level = value
+
+
+def level_name():
+    for name, value in LEVELS.items():
+        if value == level:
+            return name
+    return str(level)
@@ -2,12 +2,27 @@
 import gc
 import time
 import network
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 from relay_control import RelayController
-from web_server import start_web_server
+from web_server import WebServer
+import log
 
 # --- Піни ---
 RELAY_PINS = [5, 4, 0, 2]  # GPIO для 4 реле (D1, D2, D3, D4 on NodeMCU)
 TEMP_PIN = 14              # GPIO для DS18B20 (D5 on NodeMCU)
+SENSOR_RESOLUTION = 12     # DS18B20 bits: 9/10/11/12 -> 94/188/375/750 ms conversion, or {index: bits}
+
+# --- Керування / Control ---
+CONTROL_PERIOD_MS = 5000   # How often sensors are read and AUTO relays evaluated
+WEB_PORT = 12345
+SETTINGS_FLUSH_DELAY_MS = 3000  # Settings changes are coalesced this long before writing flash
+SETTINGS_MAX_WRITES_PER_MIN = 6
+NTP_HOST = 'pool.ntp.org'  # None without internet access (set the time via /api/time); an IP skips DNS
+TZ_OFFSET_MIN = 0          # Local time minus UTC for schedules (e.g. 120 for UTC+2; no DST)
+LOG_LEVEL = 'INFO'         # ERROR / WARNING / INFO / DEBUG; changeable at runtime via /api/log_level?level=
 
 # --- Wi-Fi ---
 # ЗАМІНІТЬ НА ВАШІ ДАНІ! / REPLACE WITH YOUR CREDENTIALS!
@@ -36,7 +51,12 @@ def connect_wifi():
         print(f'Failed to connect to Wi-Fi after {max_attempts} seconds.')
         return None
 
+async def run(controller):
+    controller.start_tasks(CONTROL_PERIOD_MS)
+    await WebServer(controller, port=WEB_PORT).serve()
+
 def main():
+    log.set_level(LOG_LEVEL)
     print("Starting ESP8266 Relay Controller")
     gc.collect()
     ip_address = connect_wifi()
@@ -45,10 +65,13 @@ def main():
         print("Could not connect to WiFi. Halting.")
         return
 
-    print(f"ESP8266 is available at IP: {ip_address} on port 12345")
+    print(f"ESP8266 is available at IP: {ip_address} on port {WEB_PORT}")
     
-    controller = RelayController(RELAY_PINS, TEMP_PIN)
-    start_web_server(controller, port=12345)
+    controller = RelayController(RELAY_PINS, TEMP_PIN, sensor_resolution=SENSOR_RESOLUTION,
+                                 flush_delay_ms=SETTINGS_FLUSH_DELAY_MS,
+                                 max_writes_per_min=SETTINGS_MAX_WRITES_PER_MIN,
+                                 tz_offset_min=TZ_OFFSET_MIN, ntp_host=NTP_HOST)
+    asyncio.run(run(controller))
 
 if __name__ == '__main__':
     main()
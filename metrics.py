@@ -0,0 +1,119 @@
+# metrics.py
+# Counters, gauges and fixed-bucket histograms, exported in the Prometheus text format.
+# Metrics are registered once at startup; updating one is an integer add (plus a short
+# bucket scan for histograms) and does not allocate. Durations are whole milliseconds
+# rather than float seconds, since every float is a heap object on MicroPython.
+import gc
+from array import array
+
+# Default bucket upper bounds (ms) for latency histograms
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500)
+
+_mem_free = getattr(gc, 'mem_free', None) # MicroPython only
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = array('I', bytearray(4 * len(buckets))) # Per bucket, not cumulative
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                self.counts[i] += 1
+                return
+            i += 1
+
+
+class Registry:
+    def __init__(self):
+        self._families = [] # [name, type, help, [(labels, metric)]] in registration order
+
+    def _add(self, name, kind, help_text, labels, metric):
+        for family in self._families:
+            if family[0] == name:
+                family[3].append((labels, metric))
+                return metric
+        self._families.append([name, kind, help_text, [(labels, metric)]])
+        return metric
+
+    def counter(self, name, help_text, labels='', fn=None):
+        """
+        :param labels: Preformatted label list, e.g. 'route="/set"'.
+        :param fn: Callable returning the value, for counts another object already keeps.
+        """
+        return self._add(name, 'counter', help_text, labels, fn or Counter())
+
+    def gauge(self, name, help_text, fn, labels=''):
+        """:param fn: Callable returning the current value, or None to omit the sample."""
+        return self._add(name, 'gauge', help_text, labels, fn)
+
+    def remove(self, labels):
+        """Drops every series with exactly these labels, e.g. those of a forgotten sensor."""
+        for family in self._families:
+            family[3] = [s for s in family[3] if s[0] != labels]
+
+    def histogram(self, name, help_text, labels='', buckets=LATENCY_BUCKETS_MS):
+        return self._add(name, 'histogram', help_text, labels, Histogram(buckets))
+
+    def render(self):
+        """Yields the exposition text one metric family at a time."""
+        for name, kind, help_text, series in self._families:
+            lines = [f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n"]
+            for labels, metric in series:
+                if isinstance(metric, Histogram):
+                    _render_histogram(lines, name, labels, metric)
+                    continue
+                value = metric.value if isinstance(metric, Counter) else metric()
+                if value is None:
+                    continue
+                lines.append(f"{name}{{{labels}}} {value}\n" if labels else f"{name} {value}\n")
+            yield "".join(lines).encode('utf-8')
+
+
+def _render_histogram(lines, name, labels, h):
+    sep = ',' if labels else ''
+    cumulative = 0
+    for bound, n in zip(h.buckets, h.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}\n')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}\n')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {h.sum}\n{name}_count{suffix} {h.count}\n")
+
+
+def mem_free():
+    return _mem_free() if _mem_free is not None else None
+
+
+def largest_free_block():
+    """
+    Largest single allocation that currently succeeds, found by bisecting bytearray sizes.
+    MicroPython has no API for this short of printing mem_info(), so it is only measured
+    when /metrics is scraped. None off-device.
+    """
+    if _mem_free is None:
+        return None
+    lo, hi = 0, _mem_free()
+    while hi - lo > 64:
+        mid = (lo + hi) // 2
+        try:
+            buf = bytearray(mid)
+            del buf
+            lo = mid
+        except MemoryError:
+            hi = mid
+    return lo
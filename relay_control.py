@@ -1,72 +1,149 @@
-import machine
-import onewire
-import ds18x20
 import time
-import ujson
+import random
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from compat import ticks_ms, ticks_diff
+from events import EventHub
+from history import TemperatureHistory
+from relay_stats import RelayStats, CAUSE_INIT, CAUSE_MANUAL, CAUSE_AUTO, CAUSE_FAULT
+from sensors import SensorRegistry, is_rom_hex, CONVERSION_TIME_MS
+from control import make_strategy
+from metrics import Registry
+import log
+from settings_store import SettingsStore, DEFAULT_FLUSH_DELAY_MS, DEFAULT_MAX_WRITES_PER_MIN, POLL_INTERVAL_MS
+from hardware import MachineBackend
+from clock import Clock, DEFAULT_NTP_HOST
+from schedule import Scheduler
 
 CONFIG_FILE = "relay_config.json"
+DEFAULT_CONTROL_PERIOD_MS = 5000
+DEFAULT_RESOLUTION = 12
+DEFAULT_EVENT_TEMP_DELTA = 0.25 # Min change (C) before a temperature is pushed to event subscribers
+# AUTO is heating hysteresis; see control.py for the strategy behind each automatic mode
+MODES = ('MANUAL', 'AUTO', 'COOLING', 'PID')
 
 class RelayController:
-    def __init__(self, relay_pins, ds18b20_pin):
-        self.relay_pins = [machine.Pin(pin, machine.Pin.OUT, value=1) for pin in relay_pins] # value=1 for OFF initially
+    def __init__(self, relay_pins, ds18b20_pin, sensor_resolution=DEFAULT_RESOLUTION,
+                 event_temp_delta=DEFAULT_EVENT_TEMP_DELTA, flush_delay_ms=DEFAULT_FLUSH_DELAY_MS,
+                 max_writes_per_min=DEFAULT_MAX_WRITES_PER_MIN, hw=None, tz_offset_min=0,
+                 ntp_host=DEFAULT_NTP_HOST):
+        """
+        :param sensor_resolution: DS18B20 resolution in bits (9-12), either one value for
+                                  all sensors or a dict {sensor slot: bits}.
+        :param event_temp_delta: Temperature change that triggers a push to event subscribers.
+        :param flush_delay_ms: How long settings changes are coalesced before being written to flash.
+        :param max_writes_per_min: Upper bound on settings writes to flash.
+        :param hw: Hardware backend (hardware.MachineBackend by default, sim.SimBackend off-device).
+        :param tz_offset_min: Local time minus UTC in minutes, for schedules.
+        :param ntp_host: NTP server for the schedule clock, None to set it only via /api/time.
+        """
+        self.hw = hw or MachineBackend()
+        self.relay_pins = [self.hw.relay_pin(pin) for pin in relay_pins] # Created OFF (active low)
         self.relay_states = [False] * len(relay_pins)
 
-        self.ds_pin = machine.Pin(ds18b20_pin)
-        self.ow = onewire.OneWire(self.ds_pin)
-        self.ds = ds18x20.DS18X20(self.ow)
-        try:
-            self.ds_sensors = self.ds.scan()
-            print(f"[INIT] Found {len(self.ds_sensors)} DS18B20 sensor(s): {self.ds_sensors}")
-        except onewire.OneWireError as e:
-            print(f"[INIT] OneWireError scanning DS18B20: {e}")
-            self.ds_sensors = []
-        except Exception as e_scan:
-            print(f"[INIT] General error scanning DS18B20: {e_scan}")
-            self.ds_sensors = []
+        self.ds = self.hw.sensor_bus(ds18b20_pin)
+        self.metrics = Registry() # Served at /metrics; the web server adds its own series
+        self.m_conversion = self.metrics.histogram(
+            "sensor_conversion_ms", "DS18B20 conversion start to results read")
+        self.m_read = self.metrics.histogram(
+            "sensor_read_ms", "Time to read all sensor scratchpads after a conversion")
+        # Sensors by ROM; slots are stable across reboots and hot-plug (see sensors.py)
+        self.sensors = SensorRegistry(self.ds, self.hw.OneWireError)
+
+        # Two-phase conversion state: start_conversion() -> wait -> collect_temperatures()
+        self.conversion_started_ms = None
+        self.conversion_time_ms = CONVERSION_TIME_MS[DEFAULT_RESOLUTION]
+        self.last_conversion_latency_ms = None # Measured convert-start to read-complete
+        self.sensor_resolution = sensor_resolution
+        self.history = TemperatureHistory(0)
+        self._sensor_labels = [] # Metric labels registered per slot, None for a free slot
+        self._sync_sensor_slots() # Sensors known from the map, present or not
+        self.version = 0
+        self.rescan_sensors()
+        if log.level <= log.INFO: print(f"[INIT] Found {len(self.sensors.present_slots())} DS18B20 sensor(s), {len(self.sensors.sensors)} known")
 
         self.default_settings = [{
             'mode': 'MANUAL',
             'low': 22.0,
             'high': 26.0,
             'hyst': 0.5,
-            'sensor_index': 0,
-            'lock': False # If True, prevents turning relay ON (both manual and auto)
+            'sensor': self.sensors.rom(0) if self.sensors.sensors else '', # ROM hex; '' = first sensor
+            'lock': False, # If True, prevents turning relay ON (both manual and auto)
+            'min_on': 0,   # Seconds a relay must stay ON before AUTO may turn it OFF (anti short-cycling)
+            'min_off': 0,  # Seconds a relay must stay OFF before AUTO may turn it ON
+            # PID mode: target, gains (output 0..1 per C, per C*s, per C/s) and time-proportioning window (s)
+            'setpoint': 24.0,
+            'kp': 0.5,
+            'ki': 0.002,
+            'kd': 0.0,
+            'window': 120
         } for _ in relay_pins]
+        self.strategies = [None] * len(relay_pins) # Control strategy per relay, rebuilt when its mode changes
+        self._outputs = [None] * len(relay_pins)   # PID duty cycles as last served in the status
 
         self.settings = [s.copy() for s in self.default_settings]
+        self.last_temps = {} # Latest readings from the control loop; served by the web API
+        # Bumped on every relay state, setting or temperature change; keys the status cache and ETag
+        self.boot_id = '%x' % random.getrandbits(24) # Keeps ETags from colliding across reboots
+        self._status_json = None
+        self._status_etag = None
+        self._status_json_version = -1
+        # Change deltas for /api/events subscribers
+        self.events = EventHub()
+        self.event_temp_delta = event_temp_delta
+        self._published_temps = {}
+        self.store = SettingsStore(CONFIG_FILE, lambda: self.settings, flush_delay_ms, max_writes_per_min)
+        self.stats = RelayStats(len(relay_pins))
+        for i in range(len(relay_pins)):
+            self.metrics.counter("relay_switches_total", "Relay state changes (persisted across reboots)",
+                                 f'relay="{i}"', lambda i=i: self.stats.switches[i])
+        # Time-of-day schedules; inactive until the clock has been set (NTP or /api/time)
+        self.clock = Clock(tz_offset_min, ntp_host)
+        self.schedules = Scheduler(len(relay_pins), self.clock, self.coerce_setting, self._apply_schedule)
+        self.clock.on_change = self.schedules.clock_changed
+        for store in self._stores():
+            labels = f'file="{store.path}"'
+            self.metrics.counter("flash_writes_total", "Files written to flash since boot",
+                                 labels, lambda store=store: store.writes)
+            self.metrics.counter("flash_writes_avoided_total", "Saves coalesced or skipped as unchanged",
+                                 labels, lambda store=store: store.writes_avoided)
+            self.metrics.gauge("flash_flush_last_ms", "Duration of the last write to flash",
+                               lambda store=store: store.last_flush_ms, labels)
+            self.metrics.gauge("flash_flush_max_ms", "Longest write to flash since boot",
+                               lambda store=store: store.max_flush_ms, labels)
         # Initialize relays to OFF state using the new set_relay logic
         # Load settings first, then set initial state based on them (though default is OFF)
         self.load_settings_from_file()
+        self.schedules.reset() # Scheduled values take precedence over the saved ones
         for i in range(len(relay_pins)):
-            self.set_relay(i, False, force=True) # Force initial OFF state, bypassing lock for init
+            self.set_relay(i, False, force=True, cause=CAUSE_INIT) # Force initial OFF state, bypassing lock for init
 
     def load_settings_from_file(self):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                loaded = ujson.load(f)
-                if isinstance(loaded, list) and len(loaded) == len(self.settings):
-                    for i, s_loaded in enumerate(loaded):
-                        for key, default_val in self.default_settings[i].items():
-                            if key in s_loaded:
-                                try:
-                                    if isinstance(default_val, float): self.settings[i][key] = float(s_loaded[key])
-                                    elif isinstance(default_val, int): self.settings[i][key] = int(s_loaded[key])
-                                    elif isinstance(default_val, bool): # For 'lock'
-                                        # Ensure 'lock' from JSON is correctly bool
-                                        if isinstance(s_loaded[key], str):
-                                            self.settings[i][key] = s_loaded[key].lower() in ('true', '1', 'yes')
-                                        else:
-                                            self.settings[i][key] = bool(s_loaded[key])
-                                    else: self.settings[i][key] = s_loaded[key] # For 'mode'
-                                except ValueError:
-                                    print(f"[LOAD] Type error for key {key} in relay {i}, using default.")
-                                    self.settings[i][key] = default_val
-                            else: self.settings[i][key] = default_val
-                    print("[LOAD] Settings loaded from file")
-                else:
-                    print("[LOAD] Config file format/length error. Using defaults.")
-                    self.settings = [s.copy() for s in self.default_settings]
-                    self.save_settings_to_file()
+            loaded = self.store.load() # Falls back to the temp/backup copy if needed
+            if isinstance(loaded, list) and len(loaded) == len(self.settings):
+                for i, s_loaded in enumerate(loaded):
+                    if 'sensor' not in s_loaded and 'sensor_index' in s_loaded:
+                        s_loaded['sensor'] = s_loaded['sensor_index'] # Files from before sensors were keyed by ROM
+                    for key, default_val in self.default_settings[i].items():
+                        if key in s_loaded:
+                            try:
+                                self.settings[i][key] = self.coerce_setting(i, key, s_loaded[key])
+                            except (ValueError, TypeError):
+                                print(f"[LOAD] Type error for key {key} in relay {i}, using default.")
+                                self.settings[i][key] = default_val
+                        else: self.settings[i][key] = default_val
+                if log.level <= log.INFO: print("[LOAD] Settings loaded from file")
+            else:
+                print("[LOAD] Config file format/length error. Using defaults.")
+                self.settings = [s.copy() for s in self.default_settings]
+                self.save_settings_to_file()
         except OSError:
             print("[LOAD] Config file not found. Using defaults and creating.")
             self.settings = [s.copy() for s in self.default_settings]
@@ -76,88 +153,363 @@ class RelayController:
             self.settings = [s.copy() for s in self.default_settings]
             self.save_settings_to_file()
 
+    def coerce_setting(self, index, key, value):
+        """
+        Converts a raw value (JSON or query string) to the type of the default setting.
+        Raises ValueError for unknown keys or unconvertible values.
+        """
+        if key not in self.default_settings[index]:
+            raise ValueError(f"unknown setting '{key}'")
+        default_val = self.default_settings[index][key]
+        if isinstance(default_val, bool): # For 'lock'; checked before int since bool is an int
+            if isinstance(value, str):
+                return value.lower() in ('true', '1', 'yes')
+            return bool(value)
+        if key == 'sensor':
+            slot = self.sensors.slot(value)
+            if slot is not None:
+                return self.sensors.rom(slot)
+            value = str(value).lower()
+            if is_rom_hex(value):
+                return value # A probe that is not on the bus (yet)
+            raise ValueError(f"unknown sensor '{value}'")
+        if isinstance(default_val, float): return float(value)
+        if key == 'window':
+            window = int(value)
+            if window < 1:
+                raise ValueError("'window' must be at least 1 s")
+            return window
+        if isinstance(default_val, int): return int(value)
+        if key == 'mode':
+            mode = str(value).upper()
+            if mode not in MODES:
+                raise ValueError(f"unknown mode '{value}'")
+            return mode
+        return value
+
+    def apply_batch(self, patches):
+        """
+        Applies several relay updates as one change. Each patch is a dict with the relay
+        index 'i', any settings keys, and optionally the target 'state' (which, like
+        toggling, switches the relay to MANUAL unless 'mode' is also given).
+        Everything is validated first; on a ValueError nothing has been applied.
+        Settings are persisted once for the whole batch.
+        """
+        if not isinstance(patches, list):
+            raise ValueError("expected a JSON array of patches")
+        validated = []
+        for patch in patches:
+            if not isinstance(patch, dict):
+                raise ValueError("each patch must be an object")
+            i = patch.get('i')
+            if not isinstance(i, int) or isinstance(i, bool) or not (0 <= i < len(self.settings)):
+                raise ValueError(f"invalid relay index {i}")
+            updates = {}
+            for key, value in patch.items():
+                if key in ('i', 'state'):
+                    continue
+                try:
+                    updates[key] = self.coerce_setting(i, key, value)
+                except (ValueError, TypeError) as e:
+                    raise ValueError(f"relay {i}: {e}")
+            state = patch.get('state')
+            if state is not None:
+                if not isinstance(state, bool):
+                    raise ValueError(f"relay {i}: 'state' must be true or false")
+                if 'mode' not in updates:
+                    updates['mode'] = 'MANUAL'
+            validated.append((i, updates, state))
+
+        for i, updates, _ in validated:
+            self.settings[i].update(updates)
+        for i, _, state in validated:
+            if state is not None:
+                self.set_relay(i, state, cause=CAUSE_MANUAL)
+        self.settings_changed()
+
+    def mark_changed(self):
+        self.version += 1
+
+    def settings_changed(self, index=None):
+        """
+        Call after editing self.settings: invalidates the status cache, notifies
+        event subscribers and persists.
+        :param index: Relay whose settings changed, None if several did.
+        """
+        self.mark_changed()
+        if index is None:
+            self.events.publish({"v": self.version, "settings": self.settings})
+        else:
+            self.events.publish({"v": self.version, "relay": index, "settings": self.settings[index]})
+        self.store.mark_dirty() # Coalesced; written by the store's background task
+
+    def _stores(self):
+        return (self.store, self.stats.store, self.sensors.store, self.schedules.store)
+
+    def flush_settings(self):
+        """Writes pending settings and relay stats now, e.g. before a deliberate reset."""
+        if self.store.dirty:
+            self.save_settings_to_file()
+        for store in self._stores()[1:]:
+            if store.dirty:
+                try:
+                    store.flush()
+                except Exception as e:
+                    print(f"[SAVE ERROR] Could not save {store.path}: {e}")
+
     def save_settings_to_file(self):
         try:
-            with open(CONFIG_FILE, 'w') as f:
-                ujson.dump(self.settings, f)
-            print("[SAVE] Settings saved to file")
+            if self.store.flush():
+                if log.level <= log.DEBUG: print(f"[SAVE] Settings saved to file ({self.store.last_flush_ms} ms)")
         except Exception as e:
             print(f"[SAVE ERROR] Could not save settings: {e}")
 
-    def read_temperatures(self):
-        temps = {}
-        if not self.ds_sensors:
-            # print("[TEMP_READ] No DS18B20 sensors in self.ds_sensors list.")
-            return temps
+    def set_sensor_resolution(self, slot, bits):
+        """
+        Writes the resolution to the sensor's configuration register.
+        Lower resolution shortens the conversion: 9 bit = 94 ms (0.5 C) ... 12 bit = 750 ms (0.0625 C).
+        """
+        if not (0 <= slot < len(self.sensors.sensors)) or not self.sensors.sensors[slot].present:
+            print(f"[RESOLUTION_ERROR] No sensor in slot {slot}")
+            return False
+        if bits not in CONVERSION_TIME_MS:
+            print(f"[RESOLUTION_ERROR] Unsupported resolution {bits} bit, expected 9-12")
+            return False
+        sensor = self.sensors.sensors[slot]
+        try:
+            scratch = self.ds.read_scratch(sensor.rom)
+            # Scratchpad bytes 2..4 are TH, TL and config; config bits 5-6 select 9..12 bit
+            self.ds.write_scratch(sensor.rom, bytes([scratch[2], scratch[3], ((bits - 9) << 5) | 0x1F]))
+        except Exception as e:
+            print(f"[RESOLUTION_ERROR] Sensor {slot}: {e}")
+            return False
+        sensor.bits = bits
+        self._update_conversion_time()
+        return True
+
+    def _update_conversion_time(self):
+        # convert_temp() is broadcast to the whole bus, so wait for the slowest sensor present
+        slowest = 0
+        for s in self.sensors.sensors:
+            if s.present:
+                slowest = max(slowest, CONVERSION_TIME_MS[s.bits or DEFAULT_RESOLUTION])
+        self.conversion_time_ms = slowest or CONVERSION_TIME_MS[DEFAULT_RESOLUTION]
+
+    def rescan_sensors(self):
+        """
+        Searches the bus for added or removed probes. Run from the control loop (the bus
+        owner) between conversions; SensorRegistry.rescan_due() rate-limits it.
+        """
+        appeared = self.sensors.rescan()
+        if appeared is None:
+            return
+        self._sync_sensor_slots()
+        for slot in self.sensors.present_slots():
+            if slot not in appeared and self.sensors.sensors[slot].bits is not None:
+                continue # Configured already; retried otherwise (e.g. a CRC error on the first attempt)
+            bits = self.sensor_resolution
+            if isinstance(bits, dict):
+                bits = bits.get(slot, DEFAULT_RESOLUTION)
+            self.set_sensor_resolution(slot, bits)
+        self._update_conversion_time()
+        self.mark_changed()
+
+    def _sync_sensor_slots(self):
+        """Gives every sensor slot its history buffer, and its metrics when the slot changes hands."""
+        while len(self.history.sensors) < len(self.sensors.sensors):
+            self.history.add_sensor()
+            self._sensor_labels.append(None)
+        for slot, sensor in enumerate(self.sensors.sensors):
+            rom = self.sensors.rom(slot)
+            labels = f'sensor="{rom}"' if rom else None
+            if labels == self._sensor_labels[slot]:
+                continue
+            if self._sensor_labels[slot] is not None:
+                self.metrics.remove(self._sensor_labels[slot])
+            self._sensor_labels[slot] = labels
+            if labels is None:
+                continue
+            self.metrics.counter("sensor_crc_errors_total", "Scratchpad reads that failed", labels,
+                                 lambda sensor=sensor: sensor.crc_errors)
+            self.metrics.counter("sensor_bad_readings_total", "85 C / -127 C readings discarded", labels,
+                                 lambda sensor=sensor: sensor.bad_readings)
+
+    def _referenced_slots(self):
+        """Slots of the sensors the relays are configured to use."""
+        return set(self._relay_sensor_slot(i) for i in range(len(self.settings)))
+
+    def _strategy(self, index):
+        mode = self.settings[index]['mode']
+        strategy = self.strategies[index]
+        if (strategy.mode if strategy is not None else 'MANUAL') != mode:
+            strategy = self.strategies[index] = make_strategy(mode) # Fresh state on every mode change
+        return strategy
+
+    def _relay_sensor_slot(self, index):
+        ref = self.settings[index].get('sensor', '')
+        return self.sensors.slot(ref if ref else 0)
+
+    def start_conversion(self):
+        """Phase 1: starts a conversion on all sensors and returns immediately."""
+        if not self.sensors.present_slots():
+            return False
         try:
             self.ds.convert_temp()
-            time.sleep_ms(750)
-            for i, rom in enumerate(self.ds_sensors):
-                try:
-                    t = self.ds.read_temp(rom)
-                    if t is not None and t != 85.0 and t != -127.0:
-                        temps[i] = round(t, 2)
-                    # else: print(f"[TEMP_READ] Invalid temp from sensor {i}")
-                except Exception as e_read_single:
-                    print(f"[TEMP_READ_ERROR] Sensor {i}: {e_read_single}")
-        except onewire.OneWireError as e_ow:
-             print(f"[TEMP_READ_ONEWIRE_ERROR] {e_ow}")
+        except self.hw.OneWireError as e_ow:
+            print(f"[TEMP_READ_ONEWIRE_ERROR] {e_ow}")
+            self.sensors.conversion_failed(e_ow)
+            return False
         except Exception as e_general:
             print(f"[TEMP_READ_GENERAL_ERROR] {e_general}")
-        return temps
+            self.sensors.conversion_failed(e_general)
+            return False
+        self.conversion_started_ms = ticks_ms()
+        return True
 
-    def control_relays_by_temp(self):
-        temps = self.read_temperatures()
-        max_sensor_idx = len(self.ds_sensors) - 1 if self.ds_sensors else -1
+    def conversion_remaining_ms(self):
+        """Milliseconds until the running conversion is done (0 if ready, None if none started)."""
+        if self.conversion_started_ms is None:
+            return None
+        return max(0, self.conversion_time_ms - ticks_diff(ticks_ms(), self.conversion_started_ms))
 
-        for i, setting in enumerate(self.settings):
-            if setting['mode'].upper() != 'AUTO':
-                continue
+    def collect_temperatures(self):
+        """Phase 2: reads the results of the conversion started by start_conversion()."""
+        if self.conversion_started_ms is None:
+            return {}
+        start = ticks_ms()
+        for slot in self.sensors.present_slots():
+            self.sensors.read(slot) # Failures are counted in the sensor's health record
+        now = ticks_ms()
+        self.m_read.observe(ticks_diff(now, start))
+        self.last_conversion_latency_ms = ticks_diff(now, self.conversion_started_ms)
+        self.m_conversion.observe(self.last_conversion_latency_ms)
+        self.conversion_started_ms = None
+        # Includes the held value of a sensor that missed a read or two; never stale ones
+        return self.sensors.temperatures()
 
-            si = int(setting.get('sensor_index', 0))
-            if not self.ds_sensors:
-                # print(f"[AUTO_CTRL {i}] No sensors.")
-                continue
-            if not (0 <= si <= max_sensor_idx):
-                print(f"[AUTO_CTRL {i}] Invalid sensor index {si}.")
+    async def read_temperatures_async(self):
+        """Non-blocking read: other tasks keep running while the sensors convert."""
+        if not self.start_conversion():
+            # Held values, dropped by the health cache once failures or age add up
+            return self.sensors.temperatures()
+        await asyncio.sleep(self.conversion_time_ms / 1000)
+        return self.collect_temperatures()
+
+    def read_temperatures(self):
+        """Blocking read for callers outside the event loop."""
+        if not self.start_conversion():
+            return self.sensors.temperatures()
+        time.sleep(self.conversion_remaining_ms() / 1000)
+        return self.collect_temperatures()
+
+    def control_relays_by_temp(self, temps=None):
+        if temps is None:
+            temps = self.read_temperatures()
+
+        now = ticks_ms()
+        for i, setting in enumerate(self.settings):
+            strategy = self._strategy(i)
+            if strategy is None: # MANUAL
                 continue
 
-            temp = temps.get(si)
+            si = self._relay_sensor_slot(i)
+            temp = None if si is None else temps.get(si)
             if temp is None:
-                # print(f"[AUTO_CTRL {i}] Temp for sensor {si} is None.")
+                # Missing, failing or stale sensor: never act on old data, fail safe to OFF
+                strategy.reset()
+                if self.relay_states[i]:
+                    print(f"[AUTO_CTRL {i}] No valid reading from sensor '{setting.get('sensor')}', turning OFF.")
+                    self.set_relay(i, False, force=True, cause=CAUSE_FAULT)
                 continue
 
+            current_pin_state_is_on = self.relay_states[i] # True if ON, False if OFF
+            want = strategy.step(temp, setting, current_pin_state_is_on, now)
+            if want is True and not current_pin_state_is_on:
+                if log.level <= log.DEBUG: print(f"[AUTO_CTRL {i}] {strategy.mode}: turn ON at {temp:.2f}")
+                self.set_relay(i, True, cause=CAUSE_AUTO) # Lock and min-off checks are inside set_relay
+            elif want is False and current_pin_state_is_on:
+                if log.level <= log.DEBUG: print(f"[AUTO_CTRL {i}] {strategy.mode}: turn OFF at {temp:.2f}")
+                # For AUTO OFF, we want to bypass the lock, as lock only prevents turning ON.
+                self.set_relay(i, False, force=True, cause=CAUSE_AUTO)
+        if temps != self.last_temps:
+            self.last_temps = temps
+            self.mark_changed()
+            self._publish_temps(temps)
+        # The cached status carries each PID output, so a moving duty cycle is a change too
+        changed = False
+        for i, strategy in enumerate(self.strategies):
+            output = round(strategy.output, 3) if strategy is not None and strategy.mode == 'PID' else None
+            if output != self._outputs[i]:
+                self._outputs[i] = output
+                changed = True
+        if changed:
+            self.mark_changed()
+        return temps
+
+    def _publish_temps(self, temps):
+        changed = {}
+        for si, t in temps.items():
+            prev = self._published_temps.get(si)
+            if prev is None or abs(t - prev) >= self.event_temp_delta:
+                self._published_temps[si] = t
+                changed[si] = t
+        if changed:
+            self.events.publish({"v": self.version, "temperatures": changed})
+
+    async def run_control_loop(self, period_ms=DEFAULT_CONTROL_PERIOD_MS):
+        """
+        Periodically reads sensors and drives AUTO relays, independent of HTTP traffic.
+        This task is the only owner of the 1-Wire bus.
+        """
+        if log.level <= log.INFO: print(f"[CONTROL_LOOP] Started, period {period_ms} ms")
+        while True:
             try:
-                low = float(setting.get('low', self.default_settings[i]['low']))
-                high = float(setting.get('high', self.default_settings[i]['high']))
-                hyst = float(setting.get('hyst', self.default_settings[i]['hyst']))
-                # 'lock' is read by set_relay directly from self.settings[i]['lock']
-            except ValueError:
-                print(f"[AUTO_CTRL {i}] Type error in settings.")
-                continue
+                if self.sensors.rescan_due(self._referenced_slots()):
+                    self.rescan_sensors()
+                self.schedules.tick()
+                temps = await self.read_temperatures_async()
+                self.history.add(temps)
+                self.stats.tick()
+                self.control_relays_by_temp(temps)
+            except Exception as e:
+                print(f"[CONTROL_LOOP_ERROR] {e}")
+            await asyncio.sleep(period_ms / 1000)
 
-            current_pin_state_is_on = self.relay_states[i] # True if ON, False if OFF
+    def _min_time_blocks(self, index, state):
+        """True if the relay has not yet been in its current state for min_on/min_off seconds."""
+        min_s = self.settings[index].get('min_off' if state else 'min_on', 0)
+        if not min_s:
+            return False
+        held = self.stats.seconds_in_state(index)
+        if held is None or held >= min_s:
+            return False
+        if log.level <= log.DEBUG: print(f"[SET_RELAY {index}] Held {'OFF' if state else 'ON'} by min time ({held}/{min_s} s).")
+        return True
 
-            # Heater logic: ON if temp <= low-hyst, OFF if temp >= high+hyst
-            if temp <= (low - hyst):
-                if not current_pin_state_is_on: # If currently OFF, try to turn ON
-                    print(f"[AUTO_CTRL {i}] Condition to turn ON: Temp={temp:.2f} <= {low - hyst:.2f}")
-                    self.set_relay(i, True) # Lock check is inside set_relay
-            elif temp >= (high + hyst):
-                if current_pin_state_is_on: # If currently ON, try to turn OFF
-                    print(f"[AUTO_CTRL {i}] Condition to turn OFF: Temp={temp:.2f} >= {high + hyst:.2f}")
-                    # For AUTO OFF, we want to bypass the lock, as lock only prevents turning ON.
-                    self.set_relay(i, False, force=True)
-            # else:
-                # print(f"[AUTO_CTRL {i}] Temp {temp:.2f} is between {low-hyst:.2f} and {high+hyst:.2f}. No change.")
-        return temps
+    def start_tasks(self, control_period_ms=DEFAULT_CONTROL_PERIOD_MS):
+        """Starts every background task the controller needs; call from inside the event loop."""
+        return [asyncio.create_task(self.run_control_loop(control_period_ms)),
+                asyncio.create_task(self.run_persistence()),
+                asyncio.create_task(self.clock.run())] # NTP sync for schedules
 
-    def set_relay(self, index, state, force=False):
+    async def run_persistence(self, interval_ms=POLL_INTERVAL_MS):
+        """Background task that performs the debounced settings and relay stats writes."""
+        while True:
+            for store in self._stores():
+                try:
+                    store.flush_if_due()
+                except Exception as e:
+                    print(f"[STORE ERROR] Flush of {store.path} failed: {e}")
+            await asyncio.sleep(interval_ms / 1000)
+
+    def set_relay(self, index, state, force=False, cause=CAUSE_MANUAL):
         """
         Sets the relay state.
         :param index: Index of the relay.
         :param state: True for ON, False for OFF.
-        :param force: If True, bypasses the lock when turning ON. Lock never prevents turning OFF.
+        :param force: If True, bypasses the lock when turning ON and re-drives the pin OFF even
+                      if it is already off. Lock never prevents turning OFF.
+        :param cause: CAUSE_* tag for the event log. AUTO switches also honour min_on/min_off.
         """
         if not (0 <= index < len(self.relay_pins)):
             print(f"[SET_RELAY_ERROR] Invalid relay index: {index}")
@@ -171,20 +523,30 @@ class RelayController:
                 # print(f"[SET_RELAY {index}] Already ON.")
                 return
             if is_locked and not force:
-                print(f"[SET_RELAY {index}] Blocked from turning ON by lock.")
+                if log.level <= log.DEBUG: print(f"[SET_RELAY {index}] Blocked from turning ON by lock.")
+                return
+            if cause == CAUSE_AUTO and self._min_time_blocks(index, True):
                 return
             # Proceed to turn ON
             self.relay_pins[index].value(0) # 0 for ON (active low)
             self.relay_states[index] = True
-            print(f"[SET_RELAY {index}] Turned ON.")
+            self.stats.record(index, True, cause)
+            self.mark_changed()
+            self.events.publish({"v": self.version, "relay": index, "state": True})
+            if log.level <= log.INFO: print(f"[SET_RELAY {index}] Turned ON.")
         else: # Attempting to turn OFF (state is False)
-            if not current_state_is_on: # Already OFF, no change
+            if not current_state_is_on and not force: # Already OFF, no change unless forced
                 # print(f"[SET_RELAY {index}] Already OFF.")
                 return
+            if cause == CAUSE_AUTO and self._min_time_blocks(index, False):
+                return
             # Proceed to turn OFF (lock does not prevent turning OFF)
             self.relay_pins[index].value(1) # 1 for OFF (active low)
             self.relay_states[index] = False
-            print(f"[SET_RELAY {index}] Turned OFF.")
+            self.stats.record(index, False, cause)
+            self.mark_changed()
+            self.events.publish({"v": self.version, "relay": index, "state": False})
+            if log.level <= log.INFO: print(f"[SET_RELAY {index}] Turned OFF.")
 
     def toggle_relay(self, index):
         if not (0 <= index < len(self.relay_pins)):
@@ -200,7 +562,73 @@ class RelayController:
         self.set_relay(index, desired_new_state_is_on)
         # No need to print here, set_relay does it.
 
-        self.save_settings_to_file() # Save changed mode and potentially lock status if GUI updates it
+        self.settings_changed(index) # Save changed mode and potentially lock status if GUI updates it
+
+    def _apply_schedule(self, index, updates):
+        """
+        Writes a schedule rule's values into the live settings. Not persisted: the rule in
+        force is applied again at boot, and a manual change holds until the next transition.
+        """
+        setting = self.settings[index]
+        if all(setting.get(k) == v for k, v in updates.items()):
+            return
+        setting.update(updates)
+        self.mark_changed()
+        self.events.publish({"v": self.version, "relay": index, "settings": setting})
+
+    def set_schedule(self, index, rules):
+        """Replaces a relay's schedule (an empty list removes it); raises ValueError if invalid."""
+        if not isinstance(index, int) or not 0 <= index < len(self.settings):
+            raise ValueError(f"invalid relay index {index}")
+        self.schedules.set_rules(index, rules)
+
+    def rename_sensor(self, ref, name):
+        """Names a sensor (by ROM hex, current name or slot); raises ValueError if invalid."""
+        slot = self.sensors.rename(ref, name)
+        self.mark_changed()
+        self.events.publish({"v": self.version, "sensor": slot, "name": self.sensors.sensors[slot].name})
+
+    def forget_sensor(self, ref):
+        """Forgets an absent sensor no relay uses, freeing its slot; raises ValueError otherwise."""
+        slot = self.sensors.slot(ref)
+        if slot is None:
+            raise ValueError(f"unknown sensor '{ref}'")
+        if slot in self._referenced_slots():
+            raise ValueError(f"sensor '{ref}' is used by a relay")
+        self.sensors.forget(slot)
+        self.history.sensors[slot].clear()
+        self._published_temps.pop(slot, None)
+        self._sync_sensor_slots()
+        self.mark_changed()
+        self.events.publish({"v": self.version, "sensor": slot, "forgotten": True})
 
     def get_relay_states(self):
-        return self.relay_states
\ No newline at end of file
+        return self.relay_states
+
+    def get_status(self):
+        relays = []
+        for i, setting in enumerate(self.settings):
+            relay = setting.copy()
+            relay['state'] = self.relay_states[i]
+            relay['sensor_index'] = self._relay_sensor_slot(i) # Slot of 'sensor', as before ROM keying
+            if self._outputs[i] is not None:
+                relay['output'] = self._outputs[i] # Current duty cycle
+            relays.append(relay)
+        return {
+            "version": self.version,
+            "temperatures": self.last_temps,
+            "num_sensors_detected": len(self.sensors.present_slots()),
+            "sensors": [s.name for s in self.sensors.sensors], # By slot, the keys of "temperatures"
+            "relays": relays
+        }
+
+    def get_status_json(self):
+        """
+        Returns (etag_bytes, json_bytes) for the current state. The bytes are serialized once per
+        version, so repeated polls with no changes cost no allocation or ujson work.
+        """
+        if self._status_json_version != self.version:
+            self._status_json = ujson.dumps(self.get_status()).encode('utf-8')
+            self._status_etag = f'"{self.boot_id}-{self.version}"'.encode('utf-8')
+            self._status_json_version = self.version
+        return self._status_etag, self._status_json
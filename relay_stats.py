@@ -0,0 +1,129 @@
+# relay_stats.py
+# Relay switch log and duty-cycle accounting, with cheap persistence across reboots.
+from array import array
+from compat import uptime_ms
+from settings_store import SettingsStore
+
+STATS_FILE = "relay_stats.json"
+EVENT_CAPACITY = 64
+# Counters only need to survive a reboot approximately; keep flash writes rare
+STATS_FLUSH_DELAY_MS = 10 * 60 * 1000
+STATS_MAX_WRITES_PER_MIN = 1
+
+# Why a relay was switched; stored in the event log
+CAUSE_INIT = 0
+CAUSE_MANUAL = 1
+CAUSE_AUTO = 2
+CAUSE_FAULT = 3 # Forced OFF because the relay's sensor has no trustworthy reading
+CAUSE_NAMES = ('INIT', 'MANUAL', 'AUTO', 'FAULT')
+
+
+class RelayStats:
+    def __init__(self, num_relays, path=STATS_FILE, event_capacity=EVENT_CAPACITY):
+        self.num_relays = num_relays
+        self.switches = array('I', bytearray(4 * num_relays))
+        self.on_time_s = array('I', bytearray(4 * num_relays))
+        self._on_time_rem_ms = array('H', bytearray(2 * num_relays))
+        self._on_since_ms = [None] * num_relays   # uptime_ms() when the relay went ON
+        self._last_switch_ms = [None] * num_relays
+
+        # Event ring: time (s since boot), relay index, state | cause << 1
+        self.event_capacity = event_capacity
+        self.event_times = array('I', bytearray(4 * event_capacity))
+        self.event_relays = array('B', bytearray(event_capacity))
+        self.event_flags = array('B', bytearray(event_capacity))
+        self.event_head = 0
+        self.event_count = 0
+
+        self.store = SettingsStore(path, self._persisted, STATS_FLUSH_DELAY_MS, STATS_MAX_WRITES_PER_MIN)
+        self._load()
+
+    def _load(self):
+        try:
+            data = self.store.load()
+            for i in range(min(self.num_relays, len(data['switches']))):
+                self.switches[i] = int(data['switches'][i])
+                self.on_time_s[i] = int(data['on_time_s'][i])
+        except OSError:
+            pass # First boot
+        except Exception as e:
+            print(f"[STATS] Could not load relay stats: {e}")
+
+    def _persisted(self):
+        return {"switches": list(self.switches), "on_time_s": self.total_on_time_s()}
+
+    def record(self, index, state, cause):
+        """Logs a relay write; the switch counter only counts actual state changes."""
+        now = uptime_ms()
+        was_on = self._on_since_ms[index] is not None
+        if state and not was_on:
+            self._on_since_ms[index] = now
+        elif not state and was_on:
+            elapsed = now - self._on_since_ms[index] + self._on_time_rem_ms[index]
+            self.on_time_s[index] += elapsed // 1000
+            self._on_time_rem_ms[index] = elapsed % 1000
+            self._on_since_ms[index] = None
+        if state != was_on:
+            self.switches[index] += 1
+            self._last_switch_ms[index] = now
+            self.store.mark_dirty()
+
+        i = self.event_head
+        self.event_times[i] = now // 1000
+        self.event_relays[i] = index
+        self.event_flags[i] = (1 if state else 0) | (cause << 1)
+        self.event_head = (i + 1) % self.event_capacity
+        if self.event_count < self.event_capacity:
+            self.event_count += 1
+
+    def seconds_in_state(self, index):
+        """Seconds since the relay last switched, None if it has not switched since boot."""
+        if self._last_switch_ms[index] is None:
+            return None
+        return (uptime_ms() - self._last_switch_ms[index]) // 1000
+
+    def total_on_time_s(self):
+        """Cumulative ON time per relay, including the interval still running."""
+        now = uptime_ms()
+        totals = []
+        for i in range(self.num_relays):
+            t = self.on_time_s[i]
+            if self._on_since_ms[i] is not None:
+                t += (now - self._on_since_ms[i]) // 1000
+            totals.append(t)
+        return totals
+
+    def tick(self):
+        """Called periodically so on-time of long-running relays is persisted too."""
+        for since in self._on_since_ms:
+            if since is not None:
+                self.store.mark_dirty()
+                return
+
+    def events(self):
+        """Logged events, oldest first, as dicts (for the stats endpoint)."""
+        out = []
+        start = (self.event_head - self.event_count) % self.event_capacity
+        for n in range(self.event_count):
+            i = (start + n) % self.event_capacity
+            flags = self.event_flags[i]
+            out.append({
+                "t": self.event_times[i],
+                "relay": self.event_relays[i],
+                "state": bool(flags & 1),
+                "cause": CAUSE_NAMES[flags >> 1]
+            })
+        return out
+
+    def get_stats(self):
+        now = uptime_ms()
+        on_time = self.total_on_time_s()
+        relays = []
+        for i in range(self.num_relays):
+            relays.append({
+                "switches": self.switches[i],
+                "on_time_s": on_time[i],
+                "on": self._on_since_ms[i] is not None,
+                "last_switch_s": None if self._last_switch_ms[i] is None else self._last_switch_ms[i] // 1000
+            })
+        return {"uptime_s": now // 1000, "relays": relays, "events": self.events()}
@@ -0,0 +1,165 @@
+# schedule.py
+# Per-relay time-of-day schedules (e.g. day/night setpoints), compiled into one sorted
+# transition table so the control tick only compares the clock against the next entry.
+from clock import format_tod, parse_tod
+from settings_store import SettingsStore
+import log
+
+SCHEDULES_FILE = "schedules.json"
+SCHEDULED_KEYS = ('mode', 'low', 'high', 'hyst', 'setpoint')
+MAX_RULES_PER_RELAY = 8
+# A clock step larger than this (NTP after a long outage, manual set) re-evaluates the
+# schedules from scratch instead of replaying every transition it skipped
+JUMP_TOLERANCE_S = 120
+
+
+class Scheduler:
+    """
+    A rule {"at": "HH:MM", <key>: <value>, ...} holds from its time until the relay's next
+    rule, wrapping around midnight. At each transition the rule's values are written into
+    the relay's live settings without touching flash; on boot, edits and clock jumps the
+    rule currently in force is applied again.
+    """
+    def __init__(self, num_relays, clock, coerce, apply):
+        """
+        :param clock: clock.Clock supplying local time.
+        :param coerce: coerce(index, key, value) validating one setting, raising ValueError.
+        :param apply: apply(index, updates) writing a rule's values into the live settings.
+        """
+        self.clock = clock
+        self.coerce = coerce
+        self.apply = apply
+        self.rules = [[] for _ in range(num_relays)] # Per relay: [(at_s, updates)] sorted by time
+        self._table = []   # Every relay's transitions: (at_s, relay, updates) sorted by time of day
+        self._pos = 0      # Index in _table of the next transition
+        self.next_at = None # Local time (s) of the next transition, None while inactive
+        self.store = SettingsStore(SCHEDULES_FILE, self._persisted)
+        self._load()
+        self.compile()
+
+    def _load(self):
+        try:
+            data = self.store.load()
+        except OSError:
+            return # No schedules yet
+        except Exception as e:
+            print(f"[SCHEDULE] Could not load schedules: {e}")
+            return
+        for i, rules in enumerate(data[:len(self.rules)]):
+            try:
+                self.rules[i] = self._validate(i, rules)
+            except ValueError as e:
+                print(f"[SCHEDULE] Ignoring schedule of relay {i}: {e}")
+
+    def _persisted(self):
+        out = []
+        for rules in self.rules:
+            entries = []
+            for at, updates in rules:
+                entry = {"at": format_tod(at)}
+                entry.update(updates)
+                entries.append(entry)
+            out.append(entries)
+        return out
+
+    def _validate(self, index, rules):
+        if not isinstance(rules, list) or len(rules) > MAX_RULES_PER_RELAY:
+            raise ValueError(f"expected a list of at most {MAX_RULES_PER_RELAY} rules")
+        compiled = []
+        for rule in rules:
+            if not isinstance(rule, dict) or 'at' not in rule:
+                raise ValueError("each rule needs an 'at' time")
+            at = parse_tod(rule['at'])
+            if any(at == other for other, _ in compiled):
+                raise ValueError(f"two rules at {rule['at']}")
+            updates = {}
+            for key, value in rule.items():
+                if key == 'at':
+                    continue
+                if key not in SCHEDULED_KEYS:
+                    raise ValueError(f"'{key}' cannot be scheduled")
+                updates[key] = self.coerce(index, key, value)
+            if not updates:
+                raise ValueError(f"rule at {rule['at']} changes nothing")
+            compiled.append((at, updates))
+        compiled.sort(key=lambda r: r[0])
+        return compiled
+
+    def set_rules(self, index, rules):
+        """Replaces a relay's schedule (an empty list removes it); raises ValueError if invalid."""
+        self.rules[index] = self._validate(index, rules)
+        self.store.mark_dirty() # One write per edit
+        self.compile()
+
+    def compile(self):
+        table = []
+        for i, rules in enumerate(self.rules):
+            for at, updates in rules:
+                table.append((at, i, updates))
+        table.sort(key=lambda t: (t[0], t[1]))
+        self._table = table
+        self.reset()
+
+    def reset(self):
+        """Applies the rule in force right now for every relay and finds the next transition."""
+        now = self.clock.now()
+        if now is None or not self._table:
+            self.next_at = None
+            return
+        tod = now % 86400
+        for i, rules in enumerate(self.rules):
+            if not rules:
+                continue
+            current = rules[-1] # Before the first rule of the day, yesterday's last one holds
+            for rule in rules:
+                if rule[0] <= tod:
+                    current = rule
+            self.apply(i, current[1])
+        pos = 0
+        while pos < len(self._table) and self._table[pos][0] <= tod:
+            pos += 1
+        day_start = now - tod
+        if pos == len(self._table):
+            pos = 0
+            day_start += 86400
+        self._pos = pos
+        self.next_at = day_start + self._table[pos][0]
+
+    def clock_changed(self, previous):
+        """
+        Clock.on_change hook. A routine resync only corrects the drift, and next_at is an
+        absolute time, so it is kept as is; manual changes made since the last transition
+        survive. The first set and real jumps re-apply the rules in force.
+        """
+        if previous is None or abs(self.clock.now() - previous) > JUMP_TOLERANCE_S:
+            self.reset()
+
+    def tick(self):
+        """Called every control tick: one comparison unless a transition is due."""
+        if self.next_at is None:
+            return
+        now = self.clock.now()
+        if now < self.next_at:
+            return
+        if now - self.next_at > JUMP_TOLERANCE_S:
+            self.reset()
+            return
+        while now >= self.next_at:
+            at, i, updates = self._table[self._pos]
+            if log.level <= log.INFO: print(f"[SCHEDULE] Relay {i}: {format_tod(at)} rule {updates}")
+            self.apply(i, updates)
+            self._pos += 1
+            if self._pos == len(self._table):
+                self._pos = 0
+                self.next_at += 86400 - at + self._table[0][0]
+            else:
+                self.next_at += self._table[self._pos][0] - at
+
+    def get_status(self):
+        return {
+            "time": format_tod(self.clock.time_of_day()),
+            "synced": self.clock.synced,
+            "source": self.clock.source,
+            "next": None if self.next_at is None else format_tod(self.next_at % 86400),
+            "relays": self._persisted()
+        }
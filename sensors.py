@@ -0,0 +1,259 @@
+# sensors.py
+# DS18B20 sensors identified by ROM address: a persistent ROM -> name/slot map, rate-limited
+# rescans for hot-plug and removal, and a per-sensor health cache for failing safe.
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+from compat import ticks_ms, ticks_diff
+from settings_store import SettingsStore
+import log
+
+SENSORS_FILE = "sensors.json"
+MAX_SENSORS = 8                  # Known ROMs kept; each one costs a history buffer (forget() frees a slot)
+RESCAN_INTERVAL_MS = 60000       # Routine bus search for added/removed probes
+RESCAN_FAULT_INTERVAL_MS = 5000  # Sooner while a sensor control relies on is failing or missing
+MAX_CONSECUTIVE_FAILURES = 3     # Failed reads before a sensor's cached value is no longer trusted
+MAX_AGE_MS = 30000               # Oldest reading control may act on
+# DS18B20 datasheet values, shared with the simulated bus in sim.py
+CONVERSION_TIME_MS = {9: 94, 10: 188, 11: 375, 12: 750} # Max conversion time per resolution (bits -> ms)
+POWER_ON_TEMP = 85.0             # Scratchpad reset value: the conversion did not run
+DISCONNECTED_TEMP = -127.0
+
+
+def rom_hex(rom):
+    return binascii.hexlify(rom).decode('utf-8')
+
+
+def is_rom_hex(text):
+    return len(text) == 16 and all(c in '0123456789abcdef' for c in text.lower())
+
+
+class SensorHealth:
+    def __init__(self, rom, name):
+        self.rom = rom               # 8-byte ROM address, None for a forgotten (free) slot
+        self.name = name
+        self.present = False         # Found by the last bus search
+        self.bits = None             # Resolution written to the sensor
+        self.value = None            # Last good reading
+        self.good_ms = None          # ticks_ms() of the last good reading
+        self.failures = 0            # Consecutive failed reads
+        self.crc_errors = 0
+        self.bad_readings = 0        # 85 C (no conversion) or -127 C (lost contact)
+
+    def age_ms(self, now):
+        return None if self.good_ms is None else ticks_diff(now, self.good_ms)
+
+
+class SensorRegistry:
+    """
+    Sensors keep a slot number (their position in the persisted map) for the lifetime of
+    the map, so history and status indices do not shift when probes come and go. Forgetting
+    an absent sensor frees its slot for the next new probe.
+    """
+    def __init__(self, ds, onewire_error, path=SENSORS_FILE):
+        """
+        :param ds: DS18X20 driver (scan, convert_temp, read_temp, read/write_scratch).
+        :param onewire_error: Exception class the bus raises.
+        """
+        self.ds = ds
+        self.onewire_error = onewire_error
+        self.sensors = []            # SensorHealth by slot
+        self.last_scan_ms = None
+        self.scans = 0
+        self.store = SettingsStore(path, self._persisted)
+        self._load()
+
+    def _load(self):
+        try:
+            for entry in self.store.load()[:MAX_SENSORS]:
+                if not entry.get('rom'):
+                    self.sensors.append(SensorHealth(None, '')) # Free slot
+                    continue
+                rom = binascii.unhexlify(entry['rom'])
+                name = entry.get('name') or ''
+                if not name or name.isdigit(): # Would shadow slot numbers (see rename)
+                    name = entry['rom']
+                self.sensors.append(SensorHealth(rom, name))
+        except OSError:
+            pass # First boot
+        except Exception as e:
+            print(f"[SENSORS] Could not load sensor map: {e}")
+
+    def _persisted(self):
+        return [{"rom": self.rom(i), "name": s.name} for i, s in enumerate(self.sensors)]
+
+    def slot(self, ref):
+        """Slot for a ROM hex string, a sensor name or a slot number; None if unknown."""
+        if isinstance(ref, int) and not isinstance(ref, bool):
+            return ref if 0 <= ref < len(self.sensors) else None
+        ref = str(ref)
+        for i, s in enumerate(self.sensors):
+            if s.rom is not None and (rom_hex(s.rom) == ref.lower() or s.name == ref):
+                return i
+        return self.slot(int(ref)) if ref.isdigit() else None
+
+    def rom(self, slot):
+        """ROM hex of the sensor in a slot, '' for a free slot."""
+        rom = self.sensors[slot].rom
+        return '' if rom is None else rom_hex(rom)
+
+    def present_slots(self):
+        return [i for i, s in enumerate(self.sensors) if s.present]
+
+    def rename(self, ref, name):
+        slot = self.slot(ref)
+        if slot is None:
+            raise ValueError(f"unknown sensor '{ref}'")
+        name = str(name).strip()
+        if not name or len(name) > 32:
+            raise ValueError("name must be 1-32 characters")
+        if name.isdigit() or is_rom_hex(name):
+            raise ValueError("name must not look like a slot number or a ROM address")
+        other = self.slot(name)
+        if other is not None and other != slot:
+            raise ValueError(f"name '{name}' is already used")
+        self.sensors[slot].name = name
+        self.store.mark_dirty()
+        return slot
+
+    def forget(self, slot):
+        """Drops an absent sensor from the map, freeing its slot; raises ValueError if present."""
+        s = self.sensors[slot]
+        if s.rom is None:
+            raise ValueError(f"slot {slot} is already free")
+        if s.present:
+            raise ValueError(f"sensor '{s.name}' is connected")
+        self.sensors[slot] = SensorHealth(None, '')
+        self.store.mark_dirty()
+        if log.level <= log.INFO: print(f"[SENSORS] Forgot sensor {slot} ({s.name})")
+
+    def rescan_due(self, watched=None):
+        """:param watched: Slots control relies on; only their faults speed up rescans (None: all)."""
+        if self.last_scan_ms is None:
+            return True
+        interval = RESCAN_INTERVAL_MS
+        for i, s in enumerate(self.sensors):
+            if s.rom is None or (watched is not None and i not in watched):
+                continue
+            if not s.present or s.failures >= MAX_CONSECUTIVE_FAILURES:
+                interval = RESCAN_FAULT_INTERVAL_MS
+                break
+        return ticks_diff(ticks_ms(), self.last_scan_ms) >= interval
+
+    def rescan(self):
+        """
+        Searches the bus and updates presence. Returns the slots that (re)appeared, which
+        need their resolution written, or None if the search itself failed.
+        """
+        self.last_scan_ms = ticks_ms()
+        self.scans += 1
+        try:
+            found = [bytes(rom) for rom in self.ds.scan()]
+        except Exception as e:
+            print(f"[SENSORS] Bus search failed: {e}")
+            return None
+        appeared = []
+        for i, s in enumerate(self.sensors):
+            present = s.rom in found
+            if present and not s.present:
+                appeared.append(i)
+                if log.level <= log.INFO: print(f"[SENSORS] Sensor {i} ({s.name}) present")
+            elif s.present and not present:
+                print(f"[SENSORS] Sensor {i} ({s.name}) missing")
+            s.present = present
+        for rom in found:
+            if any(s.rom == rom for s in self.sensors):
+                continue
+            slot = self._free_slot()
+            if slot is None:
+                print(f"[SENSORS] Ignoring {rom_hex(rom)}: already tracking {MAX_SENSORS} sensors, forget an absent one")
+                continue
+            s = SensorHealth(rom, rom_hex(rom))
+            s.present = True
+            self.sensors[slot] = s
+            appeared.append(slot)
+            self.store.mark_dirty()
+            if log.level <= log.INFO: print(f"[SENSORS] New sensor {slot}: {s.name}")
+        return appeared
+
+    def _free_slot(self):
+        for i, s in enumerate(self.sensors):
+            if s.rom is None:
+                return i
+        if len(self.sensors) >= MAX_SENSORS:
+            return None
+        self.sensors.append(None)
+        return len(self.sensors) - 1
+
+    def read(self, slot):
+        """Reads one converted sensor into the health cache. Returns True on a good reading."""
+        s = self.sensors[slot]
+        try:
+            t = self.ds.read_temp(s.rom)
+        except Exception as e:
+            if not isinstance(e, self.onewire_error):
+                s.crc_errors += 1 # The driver raises a plain Exception on a scratchpad CRC mismatch
+            s.failures += 1
+            if s.failures == MAX_CONSECUTIVE_FAILURES:
+                print(f"[SENSORS] Sensor {slot} ({s.name}) failing: {e}")
+            return False
+        if t is None or t == POWER_ON_TEMP or t == DISCONNECTED_TEMP:
+            s.bad_readings += 1
+            s.failures += 1
+            return False
+        s.value = round(t, 2)
+        s.good_ms = ticks_ms()
+        s.failures = 0
+        return True
+
+    def conversion_failed(self, error):
+        """Counts a failed bus-wide conversion against every present sensor."""
+        for slot, s in enumerate(self.sensors):
+            if s.present:
+                s.failures += 1
+                if s.failures == MAX_CONSECUTIVE_FAILURES:
+                    print(f"[SENSORS] Sensor {slot} ({s.name}) failing: {error}")
+
+    def value(self, slot, now=None):
+        """Last good reading if it is still trustworthy, else None (control must fail safe)."""
+        if not (0 <= slot < len(self.sensors)):
+            return None
+        s = self.sensors[slot]
+        if not s.present or s.value is None or s.failures >= MAX_CONSECUTIVE_FAILURES:
+            return None
+        if s.age_ms(ticks_ms() if now is None else now) > MAX_AGE_MS:
+            return None
+        return s.value
+
+    def temperatures(self):
+        """{slot: temp} for every sensor with a trustworthy reading."""
+        now = ticks_ms()
+        temps = {}
+        for i in range(len(self.sensors)):
+            t = self.value(i, now)
+            if t is not None:
+                temps[i] = t
+        return temps
+
+    def get_status(self):
+        now = ticks_ms()
+        out = []
+        for i, s in enumerate(self.sensors):
+            if s.rom is None:
+                continue
+            age = s.age_ms(now)
+            out.append({
+                "slot": i,
+                "rom": self.rom(i),
+                "name": s.name,
+                "present": s.present,
+                "ok": self.value(i, now) is not None,
+                "temp": s.value,
+                "age_s": None if age is None else age // 1000,
+                "failures": s.failures,
+                "crc_errors": s.crc_errors,
+                "bad_readings": s.bad_readings,
+                "resolution": s.bits
+            })
+        return out
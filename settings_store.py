@@ -0,0 +1,171 @@
+# settings_store.py
+# Debounced, wear-aware and power-cut-safe persistence of a JSON document on flash.
+import os
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+from compat import ticks_ms, ticks_diff, ticks_add
+
+DEFAULT_FLUSH_DELAY_MS = 3000     # Changes are coalesced for this long before hitting flash
+DEFAULT_MAX_WRITES_PER_MIN = 6
+POLL_INTERVAL_MS = 250           # How often the owner should call flush_if_due()
+MAX_RETRY_DELAY_MS = 300000      # Backoff cap after failed writes (full or read-only filesystem)
+
+
+def _crc(payload):
+    return ("%08x" % (binascii.crc32(payload) & 0xFFFFFFFF)).encode('utf-8')
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+class SettingsStore:
+    """
+    File layout: the JSON payload, a newline, then its CRC32 as 8 hex digits.
+    A save writes <path>.tmp, moves the current file to <path>.bak and renames the
+    temp file into place, so a power cut at any point leaves at least one valid copy.
+    """
+    def __init__(self, path, get_data, flush_delay_ms=DEFAULT_FLUSH_DELAY_MS,
+                 max_writes_per_min=DEFAULT_MAX_WRITES_PER_MIN):
+        """
+        :param get_data: Callable returning the object to persist; called at flush time.
+        """
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.bak_path = path + ".bak"
+        self.get_data = get_data
+        self.flush_delay_ms = flush_delay_ms
+        self.max_writes_per_min = max_writes_per_min
+
+        self.dirty = False
+        self._deadline = 0
+        self._last_payload = None
+        self._write_times = [] # ticks of the writes in the last minute, for the rate limit
+        self._failures = 0     # Consecutive failed writes, drives the retry backoff
+
+        self.writes = 0
+        self.writes_avoided = 0 # Flushes skipped because the content was unchanged, plus coalesced marks
+        self.last_flush_ms = None
+        self.max_flush_ms = 0
+
+    def _read_slot(self, path):
+        """Returns (payload, data); raises if the file is corrupt."""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        payload, sep, crc = raw.rstrip().rpartition(b"\n")
+        if sep:
+            if _crc(payload) != crc:
+                raise ValueError("checksum mismatch")
+        else:
+            payload = raw # Legacy file without checksum
+        return payload, ujson.loads(payload)
+
+    def _intact(self, path):
+        try:
+            self._read_slot(path)
+            return True
+        except Exception:
+            return False
+
+    def load(self):
+        """
+        Returns the data from the first valid slot (main, temp, backup).
+        Raises OSError if no file exists at all, ValueError if every copy is corrupt.
+        """
+        found = False
+        for path in (self.path, self.tmp_path, self.bak_path):
+            if not _exists(path):
+                continue
+            found = True
+            try:
+                payload, data = self._read_slot(path)
+            except Exception as e:
+                print(f"[STORE] Ignoring corrupt {path}: {e}")
+                continue
+            if path == self.path:
+                self._last_payload = payload
+            else:
+                # Written back to the main slot, which is missing or corrupt
+                print(f"[STORE] Recovered settings from {path}")
+                self._last_payload = None
+                self.mark_dirty()
+            return data
+        if not found:
+            raise OSError("no settings file")
+        raise ValueError("all settings copies are corrupt")
+
+    def mark_dirty(self):
+        """Schedules a flush; repeated calls before it happens cost nothing."""
+        if self.dirty:
+            self.writes_avoided += 1
+            return
+        self.dirty = True
+        self._deadline = ticks_add(ticks_ms(), self.flush_delay_ms)
+
+    def _rate_limit_wait_ms(self, now):
+        while self._write_times and ticks_diff(now, self._write_times[0]) >= 60000:
+            self._write_times.pop(0)
+        if len(self._write_times) < self.max_writes_per_min:
+            return 0
+        return 60000 - ticks_diff(now, self._write_times[0])
+
+    def flush_if_due(self):
+        if not self.dirty:
+            return False
+        now = ticks_ms()
+        if ticks_diff(now, self._deadline) < 0 or self._rate_limit_wait_ms(now) > 0:
+            return False
+        return self.flush()
+
+    def _write(self, payload):
+        with open(self.tmp_path, 'wb') as f:
+            f.write(payload)
+            f.write(b"\n")
+            f.write(_crc(payload))
+        if _exists(self.path):
+            # _last_payload is only set once the main copy is known good (loaded or written)
+            if self._last_payload is None and not self._intact(self.path):
+                os.remove(self.path) # Never rotate a corrupt copy over the last good backup
+            else:
+                if _exists(self.bak_path):
+                    os.remove(self.bak_path)
+                os.rename(self.path, self.bak_path)
+        os.rename(self.tmp_path, self.path)
+
+    def flush(self):
+        """Writes immediately (skipping identical content). Returns True if flash was written."""
+        self.dirty = False
+        payload = ujson.dumps(self.get_data()).encode('utf-8')
+        if payload == self._last_payload:
+            self.writes_avoided += 1
+            return False
+
+        start = ticks_ms()
+        # Failed attempts count against the rate limit too: each may have written part of .tmp
+        self._write_times.append(start)
+        try:
+            self._write(payload)
+        except Exception:
+            self.dirty = True
+            self._failures += 1
+            delay = min(MAX_RETRY_DELAY_MS, self.flush_delay_ms * 2 ** self._failures)
+            self._deadline = ticks_add(start, delay)
+            raise
+
+        self._failures = 0
+        self._last_payload = payload
+        self.writes += 1
+        self.last_flush_ms = ticks_diff(ticks_ms(), start)
+        if self.last_flush_ms > self.max_flush_ms:
+            self.max_flush_ms = self.last_flush_ms
+        return True
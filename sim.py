@@ -0,0 +1,187 @@
+# sim.py
+# Simulated hardware backend: relay pins, a DS18B20 bus and a simple thermal model in
+# which heater relays warm the sensors they are mapped to. Lets RelayController and the
+# web server run off-device (benchmarks, development) with realistic timing and faults.
+import random
+from compat import ticks_ms, ticks_diff
+# Shared with the controller so the simulated sensors cannot drift from what it expects
+from sensors import CONVERSION_TIME_MS, POWER_ON_TEMP
+
+
+def crc8(data):
+    """Dallas/Maxim 1-Wire CRC8 (polynomial x^8 + x^5 + x^4 + 1)."""
+    crc = 0
+    for b in data:
+        for _ in range(8):
+            mix = (crc ^ b) & 1
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            b >>= 1
+    return crc
+
+
+class SimOneWireError(Exception):
+    pass
+
+
+class SimPin:
+    def __init__(self, backend, pin_id, value=1):
+        self.backend = backend
+        self.pin_id = pin_id
+        self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        if v != self._value:
+            self.backend.advance() # Integrate the old heater state up to now
+            self._value = v
+
+
+class SimSensor:
+    def __init__(self, rom, temp):
+        self.rom = rom
+        self.temp = temp            # Actual temperature of the zone the sensor sits in
+        self.bits = 12
+        self.th = 0x4B
+        self.tl = 0x46
+        self.attached = True        # False after SimBackend.unplug()
+        self.converted = POWER_ON_TEMP
+        self.pending = None         # Temperature being converted
+        self.pending_since_ms = None
+
+    def scratch(self):
+        raw = int(self.converted * 16) & 0xFFFF
+        body = bytes([raw & 0xFF, raw >> 8, self.th, self.tl, ((self.bits - 9) << 5) | 0x1F, 0xFF, 0x0C, 0x10])
+        return body + bytes([crc8(body)])
+
+
+class SimDS18X20:
+    """Same interface as MicroPython's ds18x20.DS18X20."""
+    def __init__(self, backend, sensors):
+        self.backend = backend
+        self.sensors = sensors
+
+    def _sensor(self, rom):
+        for s in self.sensors:
+            if s.rom == rom and s.attached:
+                return s
+        raise SimOneWireError("no device %s" % bytes(rom).hex())
+
+    def scan(self):
+        return [bytearray(s.rom) for s in self.sensors if s.attached]
+
+    def convert_temp(self):
+        self.backend.advance()
+        now = ticks_ms()
+        for s in self.sensors:
+            if not s.attached:
+                continue
+            noise = random.gauss(0, self.backend.noise) if self.backend.noise else 0
+            step = 0.5 / (1 << (s.bits - 9))
+            s.pending = round((s.temp + noise) / step) * step
+            s.pending_since_ms = now
+
+    def _finish(self, s):
+        if s.pending is not None and ticks_diff(ticks_ms(), s.pending_since_ms) >= CONVERSION_TIME_MS[s.bits]:
+            s.converted = s.pending
+            s.pending = None
+
+    def read_scratch(self, rom):
+        s = self._sensor(rom)
+        self._finish(s)
+        self.backend.reads += 1
+        if self.backend.crc_error_rate and random.random() < self.backend.crc_error_rate:
+            self.backend.crc_errors += 1
+            raise Exception("CRC error")
+        return s.scratch()
+
+    def write_scratch(self, rom, buf):
+        s = self._sensor(rom)
+        s.th, s.tl = buf[0], buf[1]
+        s.bits = ((buf[2] >> 5) & 3) + 9
+
+    def read_temp(self, rom):
+        buf = self.read_scratch(rom)
+        raw = buf[0] | buf[1] << 8
+        if raw & 0x8000:
+            raw -= 0x10000
+        return raw / 16
+
+
+class SimBackend:
+    """
+    Drop-in for hardware.MachineBackend. Each sensor sits in its own thermal zone that
+    relaxes towards ambient (time constant tau_s) and is warmed by heater_power C/s by
+    every ON relay mapped to it in heaters {relay_pin_id: sensor number}.
+    """
+    OneWireError = SimOneWireError
+
+    def __init__(self, num_sensors=2, ambient=18.0, start_temp=20.0, heaters=None,
+                 heater_power=0.05, tau_s=600.0, noise=0.03, crc_error_rate=0.0, speed=1.0, seed=None):
+        """
+        :param heaters: {relay_pin_id: sensor number}; relays not listed do not affect temperatures.
+        :param noise: Standard deviation (C) of the measurement noise.
+        :param crc_error_rate: Probability that a scratchpad read fails its CRC.
+        :param speed: Simulated seconds per real second, to compress long thermal runs.
+        """
+        if seed is not None:
+            random.seed(seed)
+        self.ambient = ambient
+        self.heaters = heaters or {}
+        self.heater_power = heater_power
+        self.tau_s = tau_s
+        self.noise = noise
+        self.crc_error_rate = crc_error_rate
+        self.speed = speed
+        self.pins = {}
+        self.sensors = []
+        for i in range(num_sensors):
+            rom = bytes([0x28, 0x5A, 0x1C, 0x00, 0x00, 0x00, i])
+            self.sensors.append(SimSensor(rom + bytes([crc8(rom)]), start_temp))
+        self._last_ms = ticks_ms()
+        self.reads = 0
+        self.crc_errors = 0
+
+    def relay_pin(self, pin_id):
+        pin = SimPin(self, pin_id)
+        self.pins[pin_id] = pin
+        return pin
+
+    def sensor_bus(self, pin_id):
+        return SimDS18X20(self, self.sensors)
+
+    def unplug(self, n):
+        """Detaches sensor n from the bus (hot-plug testing)."""
+        self.sensors[n].attached = False
+
+    def plug(self, n):
+        """Re-attaches sensor n; like a real probe it powers up reporting 85 C."""
+        s = self.sensors[n]
+        s.attached = True
+        s.converted = POWER_ON_TEMP
+        s.pending = None
+
+    def advance(self):
+        """Integrates the thermal model up to now (explicit Euler in <= 1 s steps)."""
+        now = ticks_ms()
+        dt = ticks_diff(now, self._last_ms) / 1000 * self.speed
+        self._last_ms = now
+        if dt <= 0:
+            return
+        power = [0.0] * len(self.sensors)
+        for pin_id, si in self.heaters.items():
+            pin = self.pins.get(pin_id)
+            if pin is not None and pin.value() == 0 and 0 <= si < len(power): # Active low: 0 = ON
+                power[si] += self.heater_power
+        while dt > 0:
+            h = dt if dt < 1.0 else 1.0
+            for si, s in enumerate(self.sensors):
+                s.temp += ((self.ambient - s.temp) / self.tau_s + power[si]) * h
+            dt -= h
+
+    def temperatures(self):
+        """Actual (noise-free) zone temperatures, for checking what the controller achieved."""
+        self.advance()
+        return [s.temp for s in self.sensors]
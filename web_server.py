@@ -1,190 +1,526 @@
-import socket
 import gc
-import ure
-import ujson
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+from compat import print_exception, ticks_ms, ticks_diff
+from metrics import mem_free, largest_free_block
+import log
+from history import RESOLUTIONS, RAW_RECORD, ROLLUP_RECORD
+from relay_control import DEFAULT_CONTROL_PERIOD_MS
 
 DEFAULT_PORT = 12345
+DEFAULT_MAX_CONNECTIONS = 6   # Concurrent clients served (event streams included); extra ones get 503
+DEFAULT_READ_TIMEOUT = 5      # Seconds to wait for each request/header line
+DEFAULT_IDLE_TIMEOUT = 5      # Seconds a keep-alive connection may sit idle between requests
+DEFAULT_MAX_REQUESTS = 100    # Requests served on one connection before it is closed
+DEFAULT_BACKLOG = 4
+MAX_BODY = 2048               # Largest request body accepted
+GC_FREE_THRESHOLD = 12 * 1024 # Collect after a request only when free heap drops below this
+EVENTS_PATH = b"/api/events"
+EVENTS_KEEPALIVE = 15         # Seconds between SSE comment pings; also detects dead subscribers
+# Request headers kept for the handlers and connection handling; the rest are skipped
+WANTED_HEADERS = (b'if-none-match', b'connection', b'content-length')
+_HEADER_INITIALS = bytes(set(h[0] for h in WANTED_HEADERS) | set(h[0] - 32 for h in WANTED_HEADERS))
 
-def start_web_server(controller, port=DEFAULT_PORT):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
+CONNECTION_KEEP_ALIVE = b"Connection: keep-alive\r\n\r\n"
+CONNECTION_CLOSE = b"Connection: close\r\n\r\n"
+
+_mem_free = getattr(gc, 'mem_free', None) # MicroPython only
+
+
+def maybe_collect(pause=None):
+    """
+    Runs the GC only when the heap is getting tight, instead of after every request.
+    :param pause: Optional metrics.Histogram that records the collection time (ms).
+    """
+    if _mem_free is not None and _mem_free() < GC_FREE_THRESHOLD:
+        start = ticks_ms()
+        gc.collect()
+        if pause is not None:
+            pause.observe(ticks_diff(ticks_ms(), start))
+
+
+def parse_request_line(line):
+    """
+    Splits b"GET /path?query HTTP/1.1" into (method, path, query, version) byte slices
+    without decoding or regex. Returns None for a malformed line.
+    """
+    end = len(line)
+    while end and line[end - 1] in (10, 13): # strip CR/LF
+        end -= 1
+    sp1 = line.find(b' ', 0, end)
+    if sp1 <= 0:
+        return None
+    sp2 = line.find(b' ', sp1 + 1, end)
+    if sp2 < 0:
+        sp2 = end
+    if sp2 == sp1 + 1:
+        return None
+    version = line[sp2 + 1:end] if sp2 < end else b'HTTP/1.0'
+    q = line.find(b'?', sp1 + 1, sp2)
+    if q < 0:
+        return line[:sp1], line[sp1 + 1:sp2], b'', version
+    return line[:sp1], line[sp1 + 1:q], line[q + 1:sp2], version
+
+
+def query_param(query, name, default=None):
+    """Returns the raw bytes value of `name` in a b"a=1&b=2" query, scanning in place."""
+    n = len(name)
+    pos = 0
+    length = len(query)
+    while pos < length:
+        end = query.find(b'&', pos)
+        if end < 0:
+            end = length
+        if pos + n < end and query[pos + n] == 61 and query.startswith(name, pos): # 61 == '='
+            return query[pos + n + 1:end]
+        pos = end + 1
+    return default
+
+
+def response(status, body=b"", content_type=b"text/plain", extra_headers=b""):
+    """
+    Builds (head, body) for a response with an exact Content-Length. The head ends
+    after the last header line; the server appends the Connection header.
+    """
+    return (b"".join((b"HTTP/1.1 ", status, b"\r\nContent-Type: ", content_type, b"\r\n", extra_headers,
+                      f"Content-Length: {len(body)}\r\n".encode('utf-8'))),
+            body)
+
+
+def _json_response(obj):
+    return response(b"200 OK", ujson.dumps(obj).encode('utf-8'), b"application/json", b"Cache-Control: no-cache\r\n")
+
+
+REDIRECT_HOME = (b"HTTP/1.1 302 Found\r\nLocation: /\r\nContent-Length: 0\r\n", b"")
+ROOT_RESPONSE = response(b"200 OK", b"ESP8266 Relay Controller OK.")
+NOT_FOUND_RESPONSE = response(b"404 Not Found", b"Resource not found.")
+MALFORMED_RESPONSE = response(b"400 Bad Request", b"Malformed Request")
+
+
+def _handle_toggle(controller, query, headers, body):
+    idx = query_param(query, b'i')
+    if idx is None or not idx.isdigit():
+        return response(b"400 Bad Request", b"Missing index 'i' for toggle.")
+    controller.toggle_relay(int(idx))
+    return REDIRECT_HOME
+
+
+def _handle_set(controller, query, headers, body):
+    if not query:
+        return response(b"400 Bad Request", b"Missing parameters for set.")
+    try:
+        i = int(query_param(query, b'i', b'-1'))
+        if not (0 <= i < len(controller.settings)):
+            return response(b"400 Bad Request", b"Invalid relay index 'i'.")
+        # Everything is parsed first so a bad parameter leaves the settings untouched
+        patch = {'lock': query_param(query, b'lock') == b'1'}
+        for param, key in ((b'on', 'low'), (b'off', 'high'), (b'mode', 'mode'), (b'sensor', 'sensor'),
+                           (b'hyst', 'hyst'), (b'min_on', 'min_on'), (b'min_off', 'min_off'),
+                           (b'setpoint', 'setpoint'), (b'kp', 'kp'), (b'ki', 'ki'), (b'kd', 'kd'),
+                           (b'window', 'window')):
+            v = query_param(query, param)
+            if v is not None: patch[key] = controller.coerce_setting(i, key, v.decode('utf-8'))
+        s_cfg = controller.settings[i]
+        s_cfg.update(patch)
+        controller.settings_changed(i)
+        if log.level <= log.DEBUG: print(f"[SET] Settings updated for relay {i}: {s_cfg}")
+        return REDIRECT_HOME
+    except (ValueError, UnicodeError) as e_val:
+        print(f"[SET PARAMS ERROR] {e_val}")
+        return response(b"400 Bad Request", b"Invalid parameter value.")
+    except Exception as e_set:
+        print(f"[SET ERROR] {e_set}")
+        return response(b"500 Internal Server Error", b"Error processing set request.")
+
+
+def _handle_status(controller, query, headers, body):
+    try:
+        etag_bytes, js_bytes = controller.get_status_json()
+    except Exception as e_json_dump:
+        print(f"[WEB_API_ERROR] Failed to dump status to JSON: {e_json_dump}")
+        return response(b"500 Internal Server Error", b"JSON DUMP ERROR")
+
+    if headers.get(b'if-none-match') == etag_bytes:
+        return b"HTTP/1.1 304 Not Modified\r\nETag: " + etag_bytes + b"\r\n", b""
+    return response(b"200 OK", js_bytes, b"application/json",
+                    b"Cache-Control: no-cache\r\nETag: " + etag_bytes + b"\r\n")
+
+
+def _handle_relay_stats(controller, query, headers, body):
+    return _json_response(controller.stats.get_stats())
+
+
+def _handle_history(controller, query, headers, body):
+    history = controller.history
+    try:
+        sensor = controller.sensors.slot(query_param(query, b'sensor', b'0').decode('utf-8')) # Slot, ROM or name
+        since = int(query_param(query, b'since', b'0'))
+        res = query_param(query, b'res', b'raw').decode('utf-8')
+    except (ValueError, UnicodeError):
+        return response(b"400 Bad Request", b"Invalid 'sensor', 'since' or 'res'.")
+    if res not in RESOLUTIONS:
+        return response(b"400 Bad Request", b"Unknown 'res', expected raw, 1m or 15m.")
+    ring = None if sensor is None else history.get_ring(sensor, res)
+    if sensor is None or ring is None:
+        return response(b"404 Not Found", b"No history for that sensor.")
+
+    # X-Uptime lets clients map the since-boot timestamps to wall time
+    uptime = f"X-Uptime: {history.uptime()}\r\n".encode('utf-8')
+    if query_param(query, b'format') == b'bin':
+        fmt = RAW_RECORD if ring.columns == 1 else ROLLUP_RECORD
+        return response(b"200 OK", history.pack_binary(ring, since), b"application/octet-stream",
+                        uptime + f"X-Record-Format: {fmt}\r\n".encode('utf-8'))
+    # CSV length is not known up front; the body ends when the connection closes
+    return b"HTTP/1.1 200 OK\r\nContent-Type: text/csv\r\n" + uptime, history.iter_csv(ring, since)
+
+
+def _handle_batch(controller, query, headers, body):
+    try:
+        patches = ujson.loads(body)
+    except ValueError:
+        return response(b"400 Bad Request", b"Body is not valid JSON.")
+    try:
+        controller.apply_batch(patches)
+    except ValueError as e_val:
+        print(f"[BATCH PARAMS ERROR] {e_val}")
+        return response(b"400 Bad Request", str(e_val).encode('utf-8'))
+    return _handle_status(controller, query, {}, b"")
+
+
+def _handle_sensors(controller, query, headers, body):
+    return _json_response(controller.sensors.get_status())
+
+
+def _handle_sensor_names(controller, query, headers, body):
+    """
+    Body: [{"sensor": <ROM hex, name or slot>, "name": <new name>}, ...] or one such object;
+    {"sensor": .., "forget": true} instead drops an absent, unused sensor and frees its slot.
+    """
+    try:
+        renames = ujson.loads(body)
+    except ValueError:
+        return response(b"400 Bad Request", b"Body is not valid JSON.")
+    if isinstance(renames, dict):
+        renames = [renames]
+    try:
+        if not isinstance(renames, list) or not all(isinstance(r, dict) and 'sensor' in r for r in renames):
+            raise ValueError("expected objects with 'sensor' and 'name'")
+        for r in renames:
+            if r.get('forget'):
+                controller.forget_sensor(r['sensor'])
+            else:
+                controller.rename_sensor(r['sensor'], r.get('name', ''))
+    except ValueError as e_val:
+        return response(b"400 Bad Request", str(e_val).encode('utf-8'))
+    return _handle_sensors(controller, query, headers, b"")
+
+
+def _handle_metrics(controller, query, headers, body):
+    # Rendered family by family; close-delimited like the CSV export
+    return (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n",
+            controller.metrics.render())
+
+
+def _handle_log_level(controller, query, headers, body):
+    level = query_param(query, b'level')
+    if level is not None:
+        try:
+            log.set_level(level.decode('utf-8'))
+        except (ValueError, UnicodeError) as e_val:
+            return response(b"400 Bad Request", str(e_val).encode('utf-8'))
+    return response(b"200 OK", log.level_name().encode('utf-8'))
+
+
+def _handle_schedules(controller, query, headers, body):
+    return _json_response(controller.schedules.get_status())
+
+
+def _handle_schedule_edit(controller, query, headers, body):
+    """Body: [{"relay": i, "rules": [{"at": "HH:MM", "low": .., ...}, ...]}, ...] or one such object."""
     try:
-        s.bind(('0.0.0.0', port))
-    except OSError as e:
-        print(f"Error binding to port {port}: {e}")
-        return
-
-    s.listen(2)
-    print(f"Web server listening on port {port}")
-
-    while True:
-        cl = None
-        cl_file = None
-        response_sent = False # Moved here for broader scope in finally
+        edits = ujson.loads(body)
+    except ValueError:
+        return response(b"400 Bad Request", b"Body is not valid JSON.")
+    if isinstance(edits, dict):
+        edits = [edits]
+    try:
+        if not isinstance(edits, list) or not all(isinstance(e, dict) and 'relay' in e for e in edits):
+            raise ValueError("expected objects with 'relay' and 'rules'")
+        for e in edits:
+            controller.set_schedule(e['relay'], e.get('rules', []))
+    except ValueError as e_val:
+        return response(b"400 Bad Request", str(e_val).encode('utf-8'))
+    return _handle_schedules(controller, query, headers, b"")
+
+
+def _handle_time(controller, query, headers, body):
+    """?epoch=<UTC seconds> sets the clock where NTP is unavailable."""
+    epoch = query_param(query, b'epoch')
+    if epoch is not None:
         try:
-            cl, addr = s.accept()
-            # print(f"Accepted connection from {addr[0]}:{addr[1]}")
-            cl_file = cl.makefile('rwb', 0)
-            request_line_bytes = cl_file.readline()
+            controller.clock.set(int(epoch), 'api')
+        except ValueError:
+            return response(b"400 Bad Request", b"epoch must be an integer")
+    return _handle_schedules(controller, query, headers, b"")
+
+
+def _handle_root(controller, query, headers, body):
+    return ROOT_RESPONSE
 
-            if not request_line_bytes:
-                cl_file.close(); cl.close(); gc.collect(); continue
 
+# method -> path -> handler(controller, query, headers, body). Handlers return (head, body):
+# body is bytes, or a generator of byte chunks for a streamed body.
+ROUTES = {
+    b"GET": {
+        b"/": _handle_root,
+        b"/toggle": _handle_toggle,
+        b"/set": _handle_set,
+        b"/api/get_all_status": _handle_status,
+        b"/api/relays/stats": _handle_relay_stats,
+        b"/api/history": _handle_history,
+        b"/api/sensors": _handle_sensors,
+        b"/api/log_level": _handle_log_level,
+        b"/api/schedules": _handle_schedules,
+        b"/api/time": _handle_time,
+        b"/metrics": _handle_metrics,
+    },
+    b"POST": {
+        b"/api/relays": _handle_batch,
+        b"/api/sensors": _handle_sensor_names,
+        b"/api/schedules": _handle_schedule_edit,
+    },
+}
+
+
+def handle_request(controller, method, path, query=b'', headers=None, body=b''):
+    """
+    Dispatches a parsed request through ROUTES and returns (head, body). Kept free
+    of any socket I/O so it can be driven from tests or benchmarks.
+    :param headers: dict of lower-cased header name -> value (bytes) for the headers routes use.
+    """
+    handler = ROUTES.get(method, {}).get(path)
+    if handler is None:
+        if log.level <= log.DEBUG: print(f"[WEB_SERVER] Path not found: {path}")
+        return NOT_FOUND_RESPONSE
+    return handler(controller, query, headers or {}, body)
+
+
+def wants_keep_alive(version, headers):
+    connection = headers.get(b'connection', b'').lower()
+    if version == b'HTTP/1.1':
+        return connection != b'close'
+    return connection == b'keep-alive'
+
+
+class WebServer:
+    def __init__(self, controller, port=DEFAULT_PORT, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 read_timeout=DEFAULT_READ_TIMEOUT, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_requests=DEFAULT_MAX_REQUESTS):
+        self.controller = controller
+        self.port = port
+        self.max_connections = max_connections
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.active_connections = 0
+        self._server = None
+
+        m = controller.metrics
+        # Per-route series are registered up front so serving a request never allocates one
+        self._route_metrics = {}
+        for method, routes in ROUTES.items():
+            self._route_metrics[method] = by_path = {}
+            for path in routes:
+                labels = f'method="{method.decode()}",route="{path.decode()}"'
+                by_path[path] = (m.counter("http_requests_total", "Requests served", labels),
+                                 m.histogram("http_request_duration_ms", "Dispatch until the response is written", labels))
+        self._other_route = (m.counter("http_requests_total", "Requests served", 'method="",route="other"'),
+                             m.histogram("http_request_duration_ms", "Dispatch until the response is written", 'method="",route="other"'))
+        self.gc_pause = m.histogram("gc_pause_ms", "GC pauses between requests")
+        m.gauge("http_active_connections", "Open client connections", lambda: self.active_connections)
+        m.gauge("heap_free_bytes", "Free GC heap", mem_free)
+        m.gauge("heap_largest_free_block_bytes", "Largest allocatable block", largest_free_block)
+
+    async def _readline(self, reader, timeout=None):
+        # A stalled or half-open client only ever blocks its own task
+        return await asyncio.wait_for(reader.readline(), timeout or self.read_timeout)
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    async def _drain(self, writer):
+        # A client that stops reading must not hold its connection slot forever
+        await asyncio.wait_for(writer.drain(), self.read_timeout)
+
+    async def _send(self, writer, head, body, keep_alive):
+        connection = CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE
+        if isinstance(body, (bytes, bytearray)):
+            writer.write(b"".join((head, connection, body))) # One buffered write per response
+            await self._drain(writer)
+            return
+        writer.write(head + connection)
+        await self._drain(writer)
+        # Streamed body: each chunk is written out before the next one is produced
+        for chunk in body:
+            writer.write(chunk)
+            await self._drain(writer)
+
+    async def _stream_events(self, writer):
+        """
+        Server-Sent Events: a full status snapshot first, then compact deltas as they
+        are published by the controller. Holds the connection until the client goes away.
+        """
+        hub = self.controller.events
+        sub = hub.subscribe()
+        if sub is None:
+            head, body = response(b"503 Service Unavailable", b"Too many event subscribers.")
+            await self._send(writer, head, body, False)
+            return
+        try:
+            _, js_bytes = self.controller.get_status_json()
+            writer.write(b"".join((
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n",
+                CONNECTION_CLOSE, b"event: status\ndata: ", js_bytes, b"\n\n")))
+            await self._drain(writer)
+            while not sub.closed:
+                data = await sub.get(EVENTS_KEEPALIVE)
+                if data is None:
+                    if sub.closed:
+                        break
+                    data = b": ping\n\n"
+                writer.write(data)
+                await self._drain(writer)
+        finally:
+            hub.unsubscribe(sub)
+
+    async def _handle_client(self, reader, writer):
+        if self.active_connections >= self.max_connections:
             try:
-                request_line = request_line_bytes.decode('utf-8').strip()
-                parts = request_line.split()
-                if len(parts) < 2:
-                    cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nMalformed Request")
-                    response_sent = True # Mark response as sent
-                    cl_file.close(); cl.close(); gc.collect(); continue
-                method = parts[0]
-                path = parts[1]
-            except UnicodeDecodeError:
-                cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nNon-UTF8 Request")
-                response_sent = True # Mark response as sent
-                cl_file.close(); cl.close(); gc.collect(); continue
-            
-            # print(f"[WEB_SERVER] Request: {method} {path}") # Log all requests
+                head, body = response(b"503 Service Unavailable", b"Server busy.")
+                await self._send(writer, head, body, False)
+            except Exception:
+                pass
+            await self._close(writer)
+            return
 
+        self.active_connections += 1
+        response_sent = False
+        served = 0
+        try:
+            # Persistent connection: requests (pipelined or not) are answered in order
             while True:
-                line = cl_file.readline()
-                if not line or line == b'\r\n': break
-
-            if method == "GET":
-                if path.startswith("/toggle"):
-                    match = ure.search(r"i=(\d+)", path)
-                    if match:
-                        idx = int(match.group(1))
-                        controller.toggle_relay(idx) 
-                        cl.send(b"HTTP/1.0 302 Found\r\nLocation: /\r\nContent-Length: 0\r\n\r\n")
-                        response_sent = True
-                    else:
-                        cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nMissing index 'i' for toggle.")
-                        response_sent = True
-                elif path.startswith("/set"):
-                    query_match = ure.search(r"\?(.*)", path)
-                    if query_match:
-                        query = query_match.group(1)
-                        params = {}
-                        for pair in query.split('&'):
-                            if '=' in pair:
-                                k, v = pair.split('=', 1)
-                                params[k] = v
-                        try:
-                            i = int(params.get("i", "-1"))
-                            if 0 <= i < len(controller.settings):
-                                s_cfg = controller.settings[i]
-                                default_s = controller.default_settings[i]
-                                s_cfg['low'] = float(params.get('on', s_cfg.get('low', default_s['low'])))
-                                s_cfg['high'] = float(params.get('off', s_cfg.get('high', default_s['high'])))
-                                s_cfg['mode'] = params.get('mode', s_cfg.get('mode', default_s['mode'])).upper()
-                                s_cfg['sensor_index'] = int(params.get('sensor', s_cfg.get('sensor_index', default_s['sensor_index'])))
-                                s_cfg['hyst'] = float(params.get('hyst', s_cfg.get('hyst', default_s['hyst'])))
-                                s_cfg['lock'] = params.get('lock', '0') == '1'
-                                controller.save_settings_to_file()
-                                print(f"[SET] Settings updated for relay {i}: {s_cfg}")
-                                cl.send(b"HTTP/1.0 302 Found\r\nLocation: /\r\nContent-Length: 0\r\n\r\n")
-                                response_sent = True
-                            else:
-                                cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nInvalid relay index 'i'.")
-                                response_sent = True
-                        except ValueError as e_val:
-                            print(f"[SET PARAMS ERROR] {e_val}")
-                            cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nInvalid parameter value.")
-                            response_sent = True
-                        except Exception as e_set:
-                            print(f"[SET ERROR] {e_set}")
-                            cl.send(b"HTTP/1.0 500 Internal Server Error\r\n\r\nError processing set request.")
-                            response_sent = True
-                    else:
-                        cl.send(b"HTTP/1.0 400 Bad Request\r\n\r\nMissing parameters for set.")
-                        response_sent = True
-
-                elif path == "/api/get_all_status":
-                    print("[DEBUG_WEB_API] Entering /api/get_all_status handler.")
-                    temps = controller.control_relays_by_temp() # This now has more debug prints
-                    relays_current_states = controller.get_relay_states()
-                    
-                    status = {
-                        "temperatures": temps, # temps comes from control_relays_by_temp()
-                        "num_sensors_detected": len(controller.ds_sensors), # Get current count
-                        "relays": []
-                    }
-                    print(f"[DEBUG_WEB_API] Temps from controller: {temps}")
-                    print(f"[DEBUG_WEB_API] Num sensors from controller.ds_sensors: {len(controller.ds_sensors)}")
-
-                    for i_relay in range(len(controller.settings)):
-                        setting = controller.settings[i_relay]
-                        relay_on_off_state = relays_current_states[i_relay] if i_relay < len(relays_current_states) else False
-                        status["relays"].append({
-                            "state": relay_on_off_state,
-                            "mode": setting.get("mode", controller.default_settings[i_relay]["mode"]),
-                            "low": setting.get("low", controller.default_settings[i_relay]["low"]),
-                            "high": setting.get("high", controller.default_settings[i_relay]["high"]),
-                            "sensor_index": setting.get("sensor_index", controller.default_settings[i_relay]["sensor_index"]),
-                            "hyst": setting.get("hyst", controller.default_settings[i_relay]["hyst"]),
-                            "lock": setting.get("lock", controller.default_settings[i_relay]["lock"])
-                        })
-                    
-                    print(f"[DEBUG_WEB_API] Status object constructed before sending: {status}")
-                    js = ""
-                    try:
-                        js = ujson.dumps(status)
-                    except Exception as e_json_dump:
-                        print(f"[DEBUG_WEB_API_ERROR] Failed to dump status to JSON: {e_json_dump}")
-                        # Send an error response if JSON dumping fails
-                        cl.send(b"HTTP/1.0 500 Internal Server Error\r\n\r\nJSON DUMP ERROR")
-                        response_sent = True # Mark as sent
-                        # Don't proceed to send js if it's empty or caused an error
-                    
-                    if not response_sent: # Only send if no error during JSON dump
-                        js_bytes = js.encode('utf-8')
-                        cl.send(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n")
-                        cl.send(f"Content-Length: {len(js_bytes)}\r\n".encode('utf-8'))
-                        cl.send(b"\r\n") 
-                        cl.send(js_bytes)
-                        print("[DEBUG_WEB_API] Sent /api/get_all_status response.")
-                        response_sent = True
-                
-                elif path == "/": 
-                    ok_message = b"ESP8266 Relay Controller OK."
-                    cl.send(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n")
-                    cl.send(f"Content-Length: {len(ok_message)}\r\n".encode('utf-8'))
-                    cl.send(b"\r\n")
-                    cl.send(ok_message)
+                response_sent = False
+                request_line_bytes = await self._readline(reader, self.idle_timeout if served else None)
+                if not request_line_bytes:
+                    return
+
+                request = parse_request_line(request_line_bytes)
+                if request is None:
+                    await self._send(writer, MALFORMED_RESPONSE[0], MALFORMED_RESPONSE[1], False)
+                    response_sent = True
+                    return
+                method, path, query, version = request
+
+                headers = {}
+                while True:
+                    line = await self._readline(reader)
+                    if not line or line == b'\r\n': break
+                    if line[0] not in _HEADER_INITIALS:
+                        continue # Cheap skip for the headers no route looks at
+                    name, sep, value = line.partition(b':')
+                    name = name.strip().lower()
+                    if sep and name in WANTED_HEADERS:
+                        headers[name] = value.strip()
+
+                length = headers.get(b'content-length', b'0')
+                if not length.isdigit():
+                    # Framing is unknown from here on, so the connection cannot be reused
+                    head, body = response(b"400 Bad Request", b"Invalid Content-Length.")
+                    await self._send(writer, head, body, False)
+                    response_sent = True
+                    return
+                length = int(length)
+                if length > MAX_BODY:
+                    head, body = response(b"413 Payload Too Large", b"Request body too large.")
+                    await self._send(writer, head, body, False)
                     response_sent = True
+                    return
+                body = b""
+                if length:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
 
-            if not response_sent: 
-                not_found_msg = b"Resource not found."
-                cl.send(b"HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n")
-                cl.send(f"Content-Length: {len(not_found_msg)}\r\n".encode('utf-8'))
-                cl.send(b"\r\n")
-                cl.send(not_found_msg)
-                response_sent = True # Mark as sent
-                print(f"[WEB_SERVER] Path not found: {path if 'path' in locals() else 'N/A'}")
-
-        except OSError as e: 
-            print(f"[WEB_SERVER_OSError]: {e}") # e.g. ECONNRESET, ETIMEDOUT
-            # Response might not have been sent or client disconnected
-        except Exception as e_main_loop:
-            print(f"[WEB_SERVER_GeneralError_In_Loop]: {e_main_loop}")
-            import sys
-            sys.print_exception(e_main_loop) # More detailed traceback for general errors
-            if cl and not response_sent: # Try to send 500 if connection still seems open
+                if method == b"GET" and path == EVENTS_PATH:
+                    response_sent = True
+                    await self._stream_events(writer)
+                    return
+
+                served += 1
+                start = ticks_ms()
+                head, body = handle_request(self.controller, method, path, query, headers, body)
+                keep_alive = served < self.max_requests and wants_keep_alive(version, headers)
+                if not isinstance(body, (bytes, bytearray)) and b"Content-Length" not in head:
+                    keep_alive = False # Close-delimited streamed body
+                response_sent = True
+                await self._send(writer, head, body, keep_alive)
+                by_path = self._route_metrics.get(method)
+                count, duration = by_path.get(path, self._other_route) if by_path else self._other_route
+                count.value += 1
+                duration.observe(ticks_diff(ticks_ms(), start))
+                if not keep_alive:
+                    return
+                maybe_collect(self.gc_pause)
+        except asyncio.TimeoutError:
+            if not served:
+                if log.level <= log.DEBUG: print("[WEB_SERVER] Client read timed out.")
+            # else: idle keep-alive connection expired
+        except OSError as e:
+            if log.level <= log.DEBUG: print(f"[WEB_SERVER_OSError]: {e}") # e.g. ECONNRESET, ETIMEDOUT
+        except EOFError:
+            # Closed mid-body: asyncio.IncompleteReadError on CPython, EOFError on uasyncio
+            if log.level <= log.DEBUG: print("[WEB_SERVER] Client closed the connection mid-request.")
+        except Exception as e_conn:
+            print(f"[WEB_SERVER_GeneralError_In_Handler]: {e_conn}")
+            print_exception(e_conn)
+            if not response_sent:
                 try:
-                    err_msg = b"Internal Server Error"
-                    cl.send(b"HTTP/1.0 500 Internal Server Error\r\nContent-Type: text/plain\r\n")
-                    cl.send(f"Content-Length: {len(err_msg)}\r\n".encode('utf-8'))
-                    cl.send(b"\r\n")
-                    cl.send(err_msg)
+                    head, body = response(b"500 Internal Server Error", b"Internal Server Error")
+                    await self._send(writer, head, body, False)
                 except Exception as e_send_500:
                     print(f"Error sending 500 response: {e_send_500}")
         finally:
-            if cl_file:
-                try: cl_file.close()
-                except: pass
-            if cl:
-                try: cl.close()
-                except: pass
-            gc.collect()
\ No newline at end of file
+            self.active_connections -= 1
+            await self._close(writer)
+            maybe_collect(self.gc_pause)
+
+    async def serve(self, host='0.0.0.0'):
+        try:
+            self._server = await asyncio.start_server(self._handle_client, host, self.port, backlog=DEFAULT_BACKLOG)
+        except OSError as e:
+            print(f"Error binding to port {self.port}: {e}")
+            return
+        if log.level <= log.INFO: print(f"Web server listening on port {self.port} (max {self.max_connections} connections)")
+        while True:
+            await asyncio.sleep(3600)
+
+
+async def _serve_with_controller(controller, server, control_period_ms):
+    controller.start_tasks(control_period_ms)
+    await server.serve()
+
+
+def start_web_server(controller, port=DEFAULT_PORT, max_connections=DEFAULT_MAX_CONNECTIONS,
+                     read_timeout=DEFAULT_READ_TIMEOUT, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                     max_requests=DEFAULT_MAX_REQUESTS, control_period_ms=DEFAULT_CONTROL_PERIOD_MS):
+    """Blocking entry point: serves HTTP and runs the controller's background tasks, like main.run()."""
+    server = WebServer(controller, port, max_connections, read_timeout, idle_timeout, max_requests)
+    asyncio.run(_serve_with_controller(controller, server, control_period_ms))